@@ -4,9 +4,21 @@ import os
 import requests
 from dotenv import load_dotenv
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud.firestore_v1.base_query import FieldFilter
+import hashlib
 import json
-from datetime import datetime
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import clients
+import diagnosis_cache
+import image_preprocess
+import rollups
 
 # .envファイルから環境変数を読み込む
 load_dotenv()
@@ -66,7 +78,7 @@ try:
         firebase_admin.initialize_app(cred, {'storageBucket': STORAGE_BUCKET})
 
         # 初期化が成功したら、Firestoreクライアントを取得
-        db = firestore.client()
+        db = clients.get_firestore_client()
 except Exception as e:
     st.error(f"❌ Firebase Admin SDKの初期化に失敗しました。サービスアカウントキーを確認してください。")
     st.error(f"エラー詳細: {e}")
@@ -79,8 +91,11 @@ if "logged_in" not in st.session_state:
     st.session_state.user = None
     st.session_state.email = None
     st.session_state.id_token = None
+    st.session_state.refresh_token = None
+    st.session_state.id_token_expires_at = 0.0
     st.session_state.plan = "Guest"
     st.session_state.remaining_uses = 0
+    st.session_state.profile_loaded_at = None
 
 # --- Firebase Authentication REST APIの関数 ---
 FIREBASE_AUTH_BASE_URL = "https://identitytoolkit.googleapis.com/v1/accounts:"
@@ -89,7 +104,7 @@ def sign_in_with_email_and_password(email, password):
     """Firebase REST API を使ってメールとパスワードでサインインする"""
     url = f"{FIREBASE_AUTH_BASE_URL}signInWithPassword?key={FIREBASE_API_KEY}"
     data = {"email": email, "password": password, "returnSecureToken": True}
-    response = requests.post(url, json=data)
+    response = clients.http_post(clients.IDENTITY_TOOLKIT, url, json=data)
     response.raise_for_status()
     return response.json()
 
@@ -97,73 +112,421 @@ def create_user_with_email_and_password(email, password):
     """Firebase REST API を使ってメールとパスワードでユーザーを作成する"""
     url = f"{FIREBASE_AUTH_BASE_URL}signUp?key={FIREBASE_API_KEY}"
     data = {"email": email, "password": password, "returnSecureToken": True}
-    response = requests.post(url, json=data)
+    response = clients.http_post(clients.IDENTITY_TOOLKIT, url, json=data)
+    response.raise_for_status()
+    return response.json()
+
+# --- IDトークンの更新（Secure Token API） ---
+SECURE_TOKEN_URL = "https://securetoken.googleapis.com/v1/token"
+# 有効期限のこの秒数前になったら、バックグラウンドで更新を始める
+ID_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("ID_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+def refresh_id_token(refresh_token):
+    """リフレッシュトークンで新しいIDトークンを取得する"""
+    url = f"{SECURE_TOKEN_URL}?key={FIREBASE_API_KEY}"
+    data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    response = clients.http_post(clients.SECURE_TOKEN, url, data=data)
     response.raise_for_status()
     return response.json()
 
+@st.cache_resource
+def _get_token_refresh_executor():
+    # トークン更新を画面描画と並行して行うための小さなスレッドプール（プロセス内で共有）
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="token-refresh")
+
+def _store_id_token(id_token, refresh_token, expires_in):
+    st.session_state.id_token = id_token
+    st.session_state.refresh_token = refresh_token
+    st.session_state.id_token_expires_at = time.time() + int(expires_in)
+
+def _apply_token_refresh(future):
+    st.session_state.pop("id_token_refresh", None)
+    try:
+        token_info = future.result()
+    except Exception as e:
+        st.warning(f"ログイン情報の更新に失敗しました: {e}")
+        return False
+    _store_id_token(token_info["id_token"], token_info["refresh_token"], token_info["expires_in"])
+    return True
+
+def ensure_fresh_id_token():
+    """IDトークンの期限が近ければバックグラウンドで更新を始め、更新が終わっていれば反映する。
+    check_login から毎回呼ばれるので、通常は待ち時間なしで新しいトークンに切り替わる"""
+    future = st.session_state.get("id_token_refresh")
+    if future is not None and future.done():
+        _apply_token_refresh(future)
+        future = None
+    refresh_token = st.session_state.get("refresh_token")
+    if future is None and refresh_token:
+        if st.session_state.get("id_token_expires_at", 0) - time.time() < ID_TOKEN_REFRESH_MARGIN_SECONDS:
+            st.session_state.id_token_refresh = _get_token_refresh_executor().submit(refresh_id_token, refresh_token)
+
+def get_id_token():
+    """有効なIDトークンを返す。期限切れで更新中の場合だけ、更新が終わるのを待つ"""
+    ensure_fresh_id_token()
+    future = st.session_state.get("id_token_refresh")
+    if future is not None and st.session_state.get("id_token_expires_at", 0) <= time.time():
+        _apply_token_refresh(future)
+    return st.session_state.get("id_token")
+
 # --- Firestoreの操作関数 ---
-def get_user_data_from_firestore(uid):
-    """Firestoreからユーザーのプランと利用回数を取得する"""
+# 取得したプラン・残回数をセッション内で使い回す秒数（他の端末や管理画面での変更はこの間隔で反映される）
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300"))
+
+def invalidate_user_profile():
+    """キャッシュ済みのプラン・残回数を破棄し、次の check_login で読み直す"""
+    st.session_state.profile_loaded_at = None
+
+def get_user_data_from_firestore(uid, force=False):
+    """Firestoreからユーザーのプランと利用回数を取得する。
+    TTL内に同じセッションで読んだ値があればFirestoreは読まない（force=True で必ず読む）。
+    読み込みに失敗した場合は、前回読んだ値をそのまま使い、次にTTLが切れたときに読み直す"""
     global db
+    loaded_at = st.session_state.get("profile_loaded_at")
+    if not force and loaded_at and time.time() - loaded_at < PROFILE_CACHE_TTL_SECONDS:
+        return True
     doc_ref = db.collection('users').document(uid)
-    doc = doc_ref.get()
-    if doc.exists:
-        data = doc.to_dict()
-        st.session_state.plan = data.get("plan", "Free")
-        st.session_state.remaining_uses = data.get("remaining_uses", 0)
-    else:
-        st.session_state.plan = "Free"
-        st.session_state.remaining_uses = 5
-        doc_ref.set({
-            "email": st.session_state.email,
-            "plan": st.session_state.plan,
-            "remaining_uses": st.session_state.remaining_uses,
-            "created_at": firestore.SERVER_TIMESTAMP
-        })
+    try:
+        doc = doc_ref.get()
+        if doc.exists:
+            data = doc.to_dict()
+            st.session_state.plan = data.get("plan", "Free")
+            st.session_state.remaining_uses = data.get("remaining_uses", 0)
+        else:
+            st.session_state.plan = "Free"
+            st.session_state.remaining_uses = 5
+            doc_ref.set({
+                "email": st.session_state.email,
+                "plan": st.session_state.plan,
+                "remaining_uses": st.session_state.remaining_uses,
+                "created_at": firestore.SERVER_TIMESTAMP
+            })
+    except Exception as e:
+        if loaded_at:
+            # 一時的なエラーでページ全体を止めない。前回の値で続け、再読み込みはTTL後にする
+            st.session_state.profile_loaded_at = time.time()
+            st.sidebar.warning(f"ユーザー情報の更新に失敗しました。前回の情報を表示しています: {e}")
+        else:
+            st.sidebar.warning(f"ユーザー情報の取得に失敗しました: {e}")
+        return False
+    st.session_state.profile_loaded_at = time.time()
     return True
 
-def update_user_uses_in_firestore(uid, uses_to_deduct=1):
-    """Firestoreのユーザー利用回数を減らす"""
+# Firestoreの1バッチあたりの書き込み上限
+FIRESTORE_BATCH_LIMIT = 500
+
+def _rollup_ref(uid):
+    return db.collection('users').document(uid).collection(rollups.ROLLUP_COLLECTION).document(rollups.ROLLUP_DOCUMENT)
+
+def _add_records_with_rollup(writer, uid, records):
+    """診断記録と、その分の集計ドキュメントの増分を writer（バッチまたはトランザクション）に積む"""
+    collection_ref = db.collection('users').document(uid).collection('diagnoses')
+    for record_data in records:
+        record_data["created_at"] = firestore.SERVER_TIMESTAMP
+        writer.set(collection_ref.document(), record_data)
+    if records:
+        writer.set(_rollup_ref(uid), rollups.build_rollup_update(records), merge=True)
+
+def _write_records_with_rollup(uid, records):
+    """診断記録と集計ドキュメントの増分を同じバッチで書き込む。
+    上限を超える分は続くバッチに分け、各バッチにそのバッチ分の集計増分を含める"""
+    records = list(records)
+    # 集計ドキュメントの分を1件空けておく
+    size = FIRESTORE_BATCH_LIMIT - 1
+    for start in range(0, len(records), size):
+        batch = db.batch()
+        _add_records_with_rollup(batch, uid, records[start:start + size])
+        batch.commit()
+
+def record_ab_result_in_firestore(uid, winner):
+    """A/B比較の結果（"A" / "B" / None）を集計ドキュメントに加える"""
     global db
-    doc_ref = db.collection('users').document(uid)
     try:
-        doc_ref.update({
-            "remaining_uses": firestore.Increment(-uses_to_deduct),
-            "last_used_at": firestore.SERVER_TIMESTAMP
-        })
-        st.session_state.remaining_uses -= uses_to_deduct
+        _rollup_ref(uid).set(rollups.build_ab_result_update(winner), merge=True)
         return True
+    except Exception as e:
+        st.error(f"A/B比較結果の集計に失敗しました: {e}")
+        return False
+
+def get_diagnosis_rollup(uid):
+    """集計ドキュメントを1回の読み取りで取得し、表示用にまとめて返す"""
+    global db
+    snapshot = _rollup_ref(uid).get()
+    return rollups.summarize_rollup(snapshot.to_dict() if snapshot.exists else None)
+
+# --- 診断履歴の取得 ---
+# 絞り込みに使えるフィールド（複合インデックスは firestore.indexes.json に定義）
+HISTORY_FILTER_FIELDS = ["platform", "industry", "score"]
+
+def get_diagnosis_history_page(uid, filters=None, page_size=20, start_after=None):
+    """診断履歴を created_at の新しい順に1ページ分取得する。
+    start_after に前ページ最後のスナップショットを渡すと続きから読む（全件は読まない）。
+    (記録のリスト, このページ最後のスナップショット, 次ページがあるか) を返す"""
+    global db
+    query = db.collection('users').document(uid).collection('diagnoses')
+    for field, value in (filters or {}).items():
+        if field in HISTORY_FILTER_FIELDS and value:
+            query = query.where(filter=FieldFilter(field, "==", value))
+    query = query.order_by("created_at", direction=firestore.Query.DESCENDING)
+    if start_after is not None:
+        query = query.start_after(start_after)
+    # 1件多く読んで次ページの有無を判定する
+    snapshots = list(query.limit(page_size + 1).stream())
+    has_next = len(snapshots) > page_size
+    snapshots = snapshots[:page_size]
+    records = [{"id": snapshot.id, **snapshot.to_dict()} for snapshot in snapshots]
+    return records, (snapshots[-1] if snapshots else None), has_next
+
+# --- Firestore REST API での利用回数の更新（ユーザーのIDトークンで認証） ---
+# Admin SDKを使わず、セキュリティルールの範囲内でユーザー自身のドキュメントだけを更新する
+FIRESTORE_REST_BASE_URL = "https://firestore.googleapis.com/v1"
+def _firestore_rest_database():
+    return f"projects/{FIREBASE_PROJECT_ID}/databases/(default)"
+
+def _firestore_rest_document(path):
+    return f"{_firestore_rest_database()}/documents/{path}"
+
+def _usage_increment_write(uid, delta):
+    # 既存ドキュメントの remaining_uses を delta だけ増減し、last_used_at をサーバー時刻にする
+    return {
+        "transform": {
+            "document": _firestore_rest_document(f"users/{uid}"),
+            "fieldTransforms": [
+                {"fieldPath": "remaining_uses", "increment": {"integerValue": str(delta)}},
+                {"fieldPath": "last_used_at", "setToServerValue": "REQUEST_TIME"},
+            ],
+        },
+        "currentDocument": {"exists": True},
+    }
+
+def commit_usage_increments_rest(id_token, increments):
+    """{uid: 増減数} をFirestore REST APIの1回のcommitでまとめて書き込む"""
+    writes = [_usage_increment_write(uid, delta) for uid, delta in increments.items() if delta]
+    if not writes:
+        return True
+    url = f"{FIRESTORE_REST_BASE_URL}/{_firestore_rest_database()}/documents:commit"
+    response = clients.http_post(
+        clients.FIRESTORE_REST,
+        url,
+        json={"writes": writes},
+        headers={"Authorization": f"Bearer {id_token}"},
+    )
+    response.raise_for_status()
+    return True
+
+def update_user_uses_in_firestore_rest(uid, id_token, uses_to_deduct=1):
+    """Firestore REST API（ユーザーのIDトークンで認証）で利用回数を減らす"""
+    if not uid or not id_token:
+        st.error("利用回数の更新に失敗しました: ログイン情報がありません。")
+        return False
+    try:
+        return commit_usage_increments_rest(id_token, {uid: -uses_to_deduct})
     except Exception as e:
         st.error(f"利用回数の更新に失敗しました: {e}")
+        invalidate_user_profile()
         return False
 
-def add_diagnosis_record_to_firestore(uid, record_data):
-    """ユーザーの診断記録をFirestoreのdiagnosesサブコレクションに追加する"""
+# --- 利用回数の予約・確定・返却 ---
+# 予約は users/{uid} の reservations マップに入れ、期限切れのものは次の予約時に掃除する
+# （確定も返却もされずに落ちたジョブの予約が残り続けないようにする）
+# 予約の期限は 基本の秒数＋1回あたりの秒数×予約数（一括診断は混雑時に1枚数十秒かかることがある）
+RESERVATION_TTL_SECONDS = int(os.getenv("USES_RESERVATION_TTL_SECONDS", "600"))
+RESERVATION_TTL_PER_USE_SECONDS = int(os.getenv("USES_RESERVATION_TTL_PER_USE_SECONDS", "30"))
+
+def _active_reservations(data, now):
+    """ユーザードキュメントの予約のうち、期限内のもの {予約ID: 予約} と期限切れの予約IDのリストを返す"""
+    active = {}
+    expired = []
+    for reservation_id, reservation in (data.get("reservations") or {}).items():
+        if reservation.get("expires_at") and reservation["expires_at"] <= now:
+            expired.append(reservation_id)
+        else:
+            active[reservation_id] = reservation
+    return active, expired
+
+@firestore.transactional
+def _reserve_uses_transaction(transaction, doc_ref, reservation_id, uses):
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    data = snapshot.to_dict()
+    now = datetime.now(timezone.utc)
+    active, expired = _active_reservations(data, now)
+    update = {f"reservations.{other_id}": firestore.DELETE_FIELD for other_id in expired}
+    reserved = sum(other.get("uses", 0) for other in active.values())
+    remaining_uses = data.get("remaining_uses", 0)
+    if remaining_uses - reserved < uses:
+        if update:
+            transaction.update(doc_ref, update)
+        return remaining_uses, False
+    update[f"reservations.{reservation_id}"] = {
+        "uses": uses,
+        "expires_at": now + timedelta(seconds=RESERVATION_TTL_SECONDS + RESERVATION_TTL_PER_USE_SECONDS * uses),
+    }
+    transaction.update(doc_ref, update)
+    return remaining_uses, True
+
+def reserve_uses_in_firestore(uid, uses=1):
+    """利用回数を予約する（この時点では減らさない）。予約できなければNone"""
+    global db
+    doc_ref = db.collection('users').document(uid)
+    reservation_id = uuid.uuid4().hex
+    try:
+        outcome = _reserve_uses_transaction(db.transaction(), doc_ref, reservation_id, uses)
+    except Exception as e:
+        st.error(f"利用回数の予約に失敗しました: {e}")
+        return None
+    if outcome is None:
+        return None
+    remaining_uses, reserved = outcome
+    st.session_state.remaining_uses = remaining_uses
+    if not reserved:
+        return None
+    return {"uid": uid, "id": reservation_id, "uses": uses, "settled": False}
+
+@firestore.transactional
+def _commit_uses_transaction(transaction, user_ref, reservation, uses, records):
+    snapshot = user_ref.get(transaction=transaction)
+    data = snapshot.to_dict() or {}
+    active, _ = _active_reservations(data, datetime.now(timezone.utc))
+    active.pop(reservation["id"], None)
+    # 予約が期限切れで他のセッションに回数を取られていても、残高と他の予約を超えては減らさない
+    held_by_others = sum(other.get("uses", 0) for other in active.values())
+    charged = max(0, min(uses, data.get("remaining_uses", 0) - held_by_others))
+    update = {f"reservations.{reservation['id']}": firestore.DELETE_FIELD}
+    if charged:
+        update["remaining_uses"] = firestore.Increment(-charged)
+        update["last_used_at"] = firestore.SERVER_TIMESTAMP
+    transaction.update(user_ref, update)
+    _add_records_with_rollup(transaction, reservation["uid"], records)
+    return charged
+
+def commit_uses_in_firestore(reservation, uses, records=()):
+    """予約を確定する。利用回数の減算・診断記録の保存・集計の更新を1回のトランザクションで行う。
+    uses が予約数より少ない場合、残りは返却される（予約ごと消すため）"""
     global db
-    doc_ref = db.collection('users').document(uid).collection('diagnoses').document()
+    user_ref = db.collection('users').document(reservation["uid"])
+    records = list(records)
+    # 利用回数の更新と集計ドキュメントの分を空けておき、上限を超える分の記録は続くバッチで書く
+    first_size = FIRESTORE_BATCH_LIMIT - 2
     try:
-        record_data["created_at"] = firestore.SERVER_TIMESTAMP
-        doc_ref.set(record_data)
-        return True
+        charged = _commit_uses_transaction(db.transaction(), user_ref, reservation, uses, records[:first_size])
+        _write_records_with_rollup(reservation["uid"], records[first_size:])
     except Exception as e:
-        st.error(f"診断記録のFirestore保存に失敗しました: {e}")
+        st.error(f"利用回数と診断記録の保存に失敗しました: {e}")
+        invalidate_user_profile()
         return False
+    reservation["settled"] = True
+    st.session_state.remaining_uses -= charged
+    if charged < uses:
+        # 予約の期限切れで残高が足りなかった。表示中の残回数は読み直す
+        invalidate_user_profile()
+    return True
+
+def refund_uses_in_firestore(reservation):
+    """予約を取り消し、予約していた利用回数を戻す"""
+    global db
+    try:
+        db.collection('users').document(reservation["uid"]).update({
+            f"reservations.{reservation['id']}": firestore.DELETE_FIELD
+        })
+    except Exception as e:
+        st.error(f"利用回数の返却に失敗しました: {e}")
+        invalidate_user_profile()
+        return False
+    reservation["settled"] = True
+    return True
+
+@contextmanager
+def reserved_uses(uid, uses=1):
+    """利用回数を予約し、確定されずにブロックを抜けた場合（失敗・中断を含む）は自動で返却する。
+    予約できなかった場合は None を返す"""
+    reservation = reserve_uses_in_firestore(uid, uses)
+    try:
+        yield reservation
+    finally:
+        if reservation and not reservation["settled"]:
+            refund_uses_in_firestore(reservation)
 
 # --- Firebase Storageの操作関数 ---
-def upload_image_to_firebase_storage(uid, image_bytes_io, filename):
-    """画像をFirebase Storageにアップロードし、公開URLを返す"""
+# 画像は公開せず、期限付きの署名URLで表示する。URLは期限の少し前までキャッシュして使い回す
+SIGNED_URL_TTL_SECONDS = int(os.getenv("SIGNED_URL_TTL_SECONDS", "3600"))
+SIGNED_URL_CACHE_MARGIN_SECONDS = 300
+
+# 画像はSHA-256のハッシュ値をオブジェクト名にして共有する（同じ画像は1つだけ保存する）
+STORAGE_IMAGE_PREFIX = "diagnoses_images"
+# 保存済みと分かっているハッシュ値をプロセス内で覚えておく件数（Storageへの存在確認を省く）
+KNOWN_IMAGE_HASHES_MAX = int(os.getenv("KNOWN_IMAGE_HASHES_MAX", "10000"))
+
+@st.cache_resource
+def _get_known_image_hashes():
+    # オブジェクトは消さないので、期限は長めにしておく
+    return diagnosis_cache.LRUTTLCache(KNOWN_IMAGE_HASHES_MAX, 24 * 60 * 60)
+
+def _upload_if_absent(blob, data, content_type):
+    # 同時に同じ画像が来た場合も上書きしない（先に書いた方を使う）
+    try:
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+    except PreconditionFailed:
+        pass
+
+def upload_image_to_firebase_storage(image_bytes_io, extension, content_type="image/png"):
+    """画像と一覧表示用のWebPサムネイルを、内容のハッシュ値を名前にしてFirebase Storageに保存し、
+    {"image_path": 元画像のパス, "thumbnail_path": サムネイルのパス} を返す。
+    同じ内容の画像が保存済みならアップロードしない"""
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(f"users/{uid}/diagnoses_images/{filename}")
         image_bytes_io.seek(0)
-        blob.upload_from_file(image_bytes_io, content_type="image/png")
-        blob.make_public()
-        return blob.public_url
+        data = image_bytes_io.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        stored = {
+            "image_path": f"{STORAGE_IMAGE_PREFIX}/{content_hash}.{extension}",
+            "thumbnail_path": f"{STORAGE_IMAGE_PREFIX}/{content_hash}_thumb.webp",
+        }
+        known_hashes = _get_known_image_hashes()
+        if known_hashes.get(content_hash):
+            return stored
+
+        # サムネイルは元画像の後に書くので、サムネイルがあれば両方そろっている
+        bucket = clients.get_storage_bucket()
+        thumbnail_blob = bucket.blob(stored["thumbnail_path"])
+        if not thumbnail_blob.exists():
+            # サムネイルだけ欠けている（前回の作成に失敗した）場合は、元画像を送り直さずサムネイルだけ作る
+            image_blob = bucket.blob(stored["image_path"])
+            if not image_blob.exists():
+                _upload_if_absent(image_blob, data, content_type)
+            try:
+                _upload_if_absent(thumbnail_blob, image_preprocess.make_thumbnail(data), "image/webp")
+            except Exception:
+                # サムネイルがなくても一覧は元画像で表示できる（次回のアップロード時に作り直す）
+                stored["thumbnail_path"] = None
+                return stored
+        known_hashes.set(content_hash, True)
+        return stored
     except Exception as e:
         st.error(f"Firebase Storageへの画像アップロードに失敗しました: {e}")
         return None
 
+@st.cache_data(ttl=SIGNED_URL_TTL_SECONDS - SIGNED_URL_CACHE_MARGIN_SECONDS, max_entries=5000, show_spinner=False)
+def get_signed_image_url(path):
+    """Storage上の画像の署名URL（V4、SIGNED_URL_TTL_SECONDS 秒有効）を返す。
+    署名はサービスアカウントの鍵でローカルに作るのでAPI呼び出しはない"""
+    if not path:
+        return None
+    return clients.get_storage_bucket().blob(path).generate_signed_url(
+        version="v4",
+        expiration=timedelta(seconds=SIGNED_URL_TTL_SECONDS),
+        method="GET",
+    )
+
 # --- StreamlitのUI表示と認証フロー ---
+def start_user_session(user_info):
+    """サインイン/サインアップの応答からセッションを始め、プロフィールを読み込む"""
+    st.session_state.logged_in = True
+    st.session_state.user = user_info["localId"]
+    st.session_state.email = user_info["email"]
+    _store_id_token(user_info["idToken"], user_info.get("refreshToken"), user_info.get("expiresIn", 3600))
+    get_user_data_from_firestore(user_info["localId"], force=True)
+
 def login_page():
     """Streamlit上にログイン画面を表示する関数"""
     st.title("🔐 バナスコAI ログイン")
@@ -179,11 +542,7 @@ def login_page():
             with st.spinner("ログイン中..."):
                 try:
                     user_info = sign_in_with_email_and_password(email, password)
-                    st.session_state.logged_in = True
-                    st.session_state.user = user_info["localId"]
-                    st.session_state.email = user_info["email"]
-                    st.session_state.id_token = user_info["idToken"]
-                    get_user_data_from_firestore(user_info["localId"])
+                    start_user_session(user_info)
                     st.success(f"ログインしました: {user_info['email']}")
                     st.rerun()
                 except requests.exceptions.HTTPError as e:
@@ -196,11 +555,7 @@ def login_page():
             with st.spinner("アカウント作成中..."):
                 try:
                     user_info = create_user_with_email_and_password(email, password)
-                    st.session_state.logged_in = True
-                    st.session_state.user = user_info["localId"]
-                    st.session_state.email = user_info["email"]
-                    st.session_state.id_token = user_info["idToken"]
-                    get_user_data_from_firestore(user_info["localId"])
+                    start_user_session(user_info)
                     st.success(f"アカウント '{user_info['email']}' を作成し、ログインしました。")
                     st.rerun()
                 except requests.exceptions.HTTPError as e:
@@ -229,6 +584,8 @@ def check_login():
         login_page()
         st.stop()
     else:
+        ensure_fresh_id_token()
+        get_user_data_from_firestore(st.session_state.user)
         st.sidebar.write(f"ようこそ, {st.session_state.email}!")
         st.sidebar.write(f"残り回数: {st.session_state.remaining_uses}回 ({st.session_state.plan}プラン)")
         st.sidebar.button("ログアウト", on_click=logout)
\ No newline at end of file
@@ -0,0 +1,257 @@
+# batch_diagnose.py
+"""バナー画像をコマンドラインから一括採点し、結果をJSONL/CSVに書き出す。
+
+使い方:
+    python batch_diagnose.py banners/ -o results.jsonl --concurrency 4
+    python batch_diagnose.py manifest.txt -o results.csv --mock --mock-latency 1.5
+    LLM_BACKEND=local python batch_diagnose.py banners/ -o load.jsonl --concurrency 16
+    python batch_diagnose.py banners/ -o separate.jsonl --industry 美容 --compliance separate
+
+--compliance で薬機法チェックの方式（採点と同じ1回のリクエスト / 従来どおり別リクエスト）を切り替えられ、
+出力の llm_calls / llm_ms / prompt_tokens / completion_tokens で両者のレイテンシとトークン数を比較できる。
+
+--mock はプロセス内の偽クライアント（llm_backends.FakeOpenAIClient）で採点する。
+LLM_BACKEND=local にすると mock_llm_server.py に接続するので、通信・遅延・エラーを含めて負荷試験ができる。
+
+中断しても同じ出力先を指定して再実行すれば、完了済みの画像はスキップされる。
+完了済みかどうかは 画像パス＋採点条件＋プロンプトのバージョン（resume_key）で判定し、
+条件を変えて再実行した画像は採点し直す。失敗した行は再実行の結果で置き換える。
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import image_preprocess
+import llm_backends
+import scoring
+import yakujihou
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+OUTPUT_FIELDS = [
+    "path", "resume_key", "prompt_version", "status", "score", "comment",
+    *[key for key, _ in scoring.CRITERIA],
+    "yakujihou", "error", "elapsed_ms", "llm_calls", "llm_ms", "prompt_tokens", "completion_tokens",
+    "original_bytes", "sent_bytes", "image_tokens",
+]
+
+
+def collect_inputs(source):
+    """ディレクトリ（再帰）またはマニフェスト（1行1パス）から画像パスの一覧を返す"""
+    source = Path(source)
+    if source.is_dir():
+        return sorted(
+            path for path in source.rglob("*")
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+        )
+    paths = []
+    for line in source.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        path = Path(line)
+        paths.append(path if path.is_absolute() else source.parent / path)
+    return paths
+
+
+def resume_key(path, settings, compliance):
+    """再開時に「同じ採点」かどうかを判定するキー（画像パス＋採点条件＋プロンプトのバージョン）"""
+    params = json.dumps([str(path), settings, compliance, scoring.PROMPT_VERSION], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+
+def load_results(output_path):
+    """既存の出力ファイルの行を読み込む（再開用）"""
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return []
+    with output_path.open(encoding="utf-8", newline="") as f:
+        if output_path.suffix.lower() == ".csv":
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rewrite_results(output_path, rows):
+    """出力ファイルを rows だけに書き直す（一時ファイルに書いてから置き換える）"""
+    output_path = Path(output_path)
+    temp_path = output_path.with_suffix(".tmp" + output_path.suffix)
+    writer = ResultWriter(temp_path)
+    try:
+        for row in rows:
+            writer.write(row)
+    finally:
+        writer.close()
+    os.replace(temp_path, output_path)
+
+
+class ResultWriter:
+    """結果を1件ずつ追記してフラッシュする（途中で止まっても書いた分は残る）"""
+
+    def __init__(self, output_path):
+        self.path = Path(output_path)
+        self.is_csv = self.path.suffix.lower() == ".csv"
+        is_new = not self.path.exists() or self.path.stat().st_size == 0
+        self.file = self.path.open("a", encoding="utf-8", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=OUTPUT_FIELDS, extrasaction="ignore")
+            if is_new:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.is_csv:
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def diagnose_file(client, path, settings, compliance="fused"):
+    """1枚の画像を採点し、出力用の行を返す"""
+    started = time.perf_counter()
+    row = {field: None for field in OUTPUT_FIELDS}
+    row["path"] = str(path)
+    row.update({"llm_calls": 0, "llm_ms": 0, "prompt_tokens": 0, "completion_tokens": 0})
+
+    def call_llm(request, *args, **kwargs):
+        # LLM呼び出し1回分の時間とトークン数を集計する
+        call_started = time.perf_counter()
+        content, usage = request(*args, **kwargs)
+        row["llm_calls"] += 1
+        row["llm_ms"] += round((time.perf_counter() - call_started) * 1000)
+        row["prompt_tokens"] += usage["prompt_tokens"]
+        row["completion_tokens"] += usage["completion_tokens"]
+        return content
+
+    try:
+        data = path.read_bytes()
+        vision_image = image_preprocess.prepare_vision_image(data)
+        check_compliance = yakujihou.needs_yakujihou_check(settings["industry"])
+        content = call_llm(
+            scoring.request_scoring_with_usage,
+            client,
+            vision_image["data"],
+            settings["age_group"],
+            settings["purpose"],
+            settings["score_format"],
+            mime_type=vision_image["mime_type"],
+            detail=vision_image["detail"],
+            include_compliance=check_compliance and compliance == "fused",
+        )
+        row["score"], row["comment"], criteria = scoring.parse_scoring_response(content)
+        row.update(criteria or {})
+        if check_compliance and compliance == "fused":
+            row["yakujihou"] = scoring.parse_compliance_result(content)
+        elif check_compliance and not yakujihou.find_ng_expressions(row["comment"]):
+            # ローカル辞書に該当がなければLLMは呼ばない
+            row["yakujihou"] = yakujihou.LOCAL_OK_RESULT
+        elif check_compliance:
+            row["yakujihou"] = call_llm(yakujihou.request_yakujihou_check, client, row["comment"])
+        row["status"] = "ok" if scoring.PARSE_FAILED not in (row["score"], row["comment"]) else "parse_error"
+        row["original_bytes"] = vision_image["original_bytes"]
+        row["sent_bytes"] = vision_image["bytes"]
+        row["image_tokens"] = vision_image["tokens"]
+    except Exception as e:
+        row["status"] = "error"
+        row["error"] = str(e)
+    row["elapsed_ms"] = round((time.perf_counter() - started) * 1000)
+    return row
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="バナー画像を一括でAI採点し、JSONL/CSVに書き出します。")
+    parser.add_argument("source", help="画像ディレクトリ、または1行1パスのマニフェストファイル")
+    parser.add_argument("-o", "--output", required=True, help="出力先（.jsonl または .csv）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に採点する枚数（既定: 4）")
+    parser.add_argument("--age-group", default="指定なし")
+    parser.add_argument("--purpose", default="プロフィール誘導")
+    parser.add_argument("--score-format", default="A/B/C", choices=["A/B/C", "100点満点"])
+    parser.add_argument("--platform", default="Instagram")
+    parser.add_argument("--industry", default="その他")
+    parser.add_argument("--compliance", default="fused", choices=["fused", "separate"],
+                        help="薬機法対象業種での薬機法チェック方式（fused: 採点と同じリクエスト / separate: 別リクエスト）")
+    parser.add_argument("--mock", action="store_true", help="OpenAIを呼ばず偽クライアントで採点する（LLM_BACKEND=fake と同じ）")
+    parser.add_argument("--mock-latency", type=float, default=0.0, help="--mock時にLLM呼び出し1回ごとに待つ秒数")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = {
+        "age_group": args.age_group,
+        "purpose": args.purpose,
+        "score_format": args.score_format,
+        "platform": args.platform,
+        "industry": args.industry,
+    }
+
+    if args.mock:
+        client = llm_backends.FakeOpenAIClient(latency=args.mock_latency)
+    else:
+        client = llm_backends.create_client()
+        if client is None:
+            print("OPENAI_API_KEY が設定されていません。オフラインで試す場合は --mock を指定してください。", file=sys.stderr)
+            return 2
+
+    paths = collect_inputs(args.source)
+    keys = {resume_key(path, settings, args.compliance): path for path in paths}
+    results = load_results(args.output)
+    completed = {row.get("resume_key") for row in results if row.get("status") == "ok"}
+    pending = {key: path for key, path in keys.items() if key not in completed}
+    # 今回採点し直す画像の失敗行は消し、新しい結果で置き換える
+    kept = [row for row in results if row.get("status") == "ok" or row.get("resume_key") not in pending]
+    # 列が今の OUTPUT_FIELDS と違う（古い形式の）CSVも、追記の前に書き直して列を揃える
+    if len(kept) != len(results) or (results and list(results[0]) != OUTPUT_FIELDS):
+        rewrite_results(args.output, kept)
+    print(f"対象 {len(paths)} 件 / 完了済み {len(paths) - len(pending)} 件 / 実行 {len(pending)} 件", file=sys.stderr)
+
+    writer = ResultWriter(args.output)
+    started = time.perf_counter()
+    failures = 0
+    totals = {"llm_calls": 0, "llm_ms": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    executor = ThreadPoolExecutor(max_workers=max(1, args.concurrency))
+    try:
+        futures = {
+            executor.submit(diagnose_file, client, path, settings, args.compliance): key
+            for key, path in pending.items()
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            row["resume_key"] = futures[future]
+            row["prompt_version"] = scoring.PROMPT_VERSION
+            writer.write(row)
+            for key in totals:
+                totals[key] += row[key] or 0
+            if row["status"] != "ok":
+                failures += 1
+            print(f"[{done}/{len(pending)}] {row['path']} {row['status']} {row['score'] or ''}", file=sys.stderr)
+    except KeyboardInterrupt:
+        # 未着手の画像は捨てる。書き込み済みの結果は次回の再開時にスキップされる
+        print("中断しました。同じコマンドで再実行すると続きから再開します。", file=sys.stderr)
+        executor.shutdown(wait=False, cancel_futures=True)
+        return 130
+    finally:
+        executor.shutdown(wait=True)
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"完了: {len(pending)} 件 / 失敗 {failures} 件 / {elapsed:.1f} 秒", file=sys.stderr)
+    if pending:
+        print(
+            f"LLM: 1件あたり {totals['llm_calls'] / len(pending):.2f} 回 / "
+            f"平均 {totals['llm_ms'] / len(pending):.0f} ms / "
+            f"入力 {totals['prompt_tokens']} トークン / 出力 {totals['completion_tokens']} トークン",
+            file=sys.stderr
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# bench_usage_counter.py
+"""利用回数の更新（Admin SDK / Firestore REST）のレイテンシを比較する。
+
+使い方:
+    python bench_usage_counter.py --email bench@example.com --password ******** -n 30
+
+指定したユーザーの remaining_uses を -1 / +1 交互に更新するので、終了後の値は実行前と同じになる。
+Firebaseの環境変数（.env）は streamlit_app.py と同じものを使う。
+"""
+import argparse
+import statistics
+import sys
+import time
+
+from firebase_admin import firestore
+
+import auth_utils
+
+
+def measure(label, operation, count):
+    """operation(delta) を count 回（-1 / +1 交互）実行し、1回あたりのミリ秒を表示する"""
+    operation(-1)
+    operation(1)  # ウォームアップ（接続確立を計測に含めない）
+    timings = []
+    for i in range(count):
+        started = time.perf_counter()
+        operation(-1 if i % 2 == 0 else 1)
+        timings.append((time.perf_counter() - started) * 1000)
+    if count % 2:
+        operation(1)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{label:<12} 平均 {statistics.mean(timings):7.1f} ms / 中央値 {statistics.median(timings):7.1f} ms / p95 {p95:7.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="利用回数更新のレイテンシを比較します。")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("-n", "--count", type=int, default=20, help="各方式の計測回数（既定: 20）")
+    args = parser.parse_args(argv)
+
+    user_info = auth_utils.sign_in_with_email_and_password(args.email, args.password)
+    uid, id_token = user_info["localId"], user_info["idToken"]
+    doc_ref = auth_utils.db.collection("users").document(uid)
+
+    def admin_sdk(delta):
+        doc_ref.update({"remaining_uses": firestore.Increment(delta), "last_used_at": firestore.SERVER_TIMESTAMP})
+
+    def rest(delta):
+        auth_utils.commit_usage_increments_rest(id_token, {uid: delta})
+
+    measure("Admin SDK", admin_sdk, args.count)
+    measure("REST", rest, args.count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+# clients.py
+import os
+
+import requests
+import streamlit as st
+from firebase_admin import firestore, storage
+from requests.adapters import HTTPAdapter
+
+import llm_backends
+
+# --- 接続プール・タイムアウト設定 ---
+# プロセス内で1つのクライアントを共有し、keep-alive接続を使い回してTLSハンドシェイクを省く
+# （OpenAIクライアントの設定は llm_backends にある）
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "15"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+# 用途ごとのHTTPセッション名
+IDENTITY_TOOLKIT = "identitytoolkit"
+GAS = "gas"
+FIRESTORE_REST = "firestore"
+SECURE_TOKEN = "securetoken"
+
+
+@st.cache_resource
+def get_openai_client():
+    """共有のLLMクライアントを返す（LLM_BACKEND で選ぶ）。APIキーが未設定なら偽クライアント（デモモード）"""
+    return llm_backends.create_client() or llm_backends.FakeOpenAIClient()
+
+
+@st.cache_resource
+def get_http_session(name):
+    """用途ごとに共有のrequests.Sessionを返す（keep-alive接続をプールする）"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http_post(name, url, **kwargs):
+    """共有セッションでPOSTする。タイムアウト未指定なら既定値を使う"""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT_SECONDS)
+    return get_http_session(name).post(url, **kwargs)
+
+
+@st.cache_resource
+def get_firestore_client():
+    """共有のFirestoreクライアントを返す（Firebase Admin SDKの初期化後に呼ぶ）"""
+    return firestore.client()
+
+
+@st.cache_resource
+def get_storage_bucket():
+    """共有のStorageバケットを返す（Firebase Admin SDKの初期化後に呼ぶ）"""
+    return storage.bucket()
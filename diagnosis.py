@@ -0,0 +1,214 @@
+# diagnosis.py
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+
+import auth_utils
+import diagnosis_cache
+import image_preprocess
+import llm_backends
+import scoring
+import uploads
+import yakujihou
+
+# 同時に実行する診断パイプラインの上限（プロセス全体で共有）
+DIAGNOSIS_MAX_WORKERS = int(os.getenv("DIAGNOSIS_MAX_WORKERS", "4"))
+# 一括診断で指定できる並行数の上限
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "8"))
+# 採点と並行して走らせるStorageアップロードの上限
+UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", "4"))
+
+
+def sanitize(value):
+    """Noneや取得失敗の値を「エラー」に置き換える"""
+    if value is None or value == scoring.PARSE_FAILED:
+        return "エラー"
+    return value
+
+
+def new_result(pattern):
+    """診断結果の辞書（初期値）を作る"""
+    return {
+        "pattern": pattern,
+        "score": None,
+        "comment": None,
+        "criteria": None,
+        "yakujihou": None,
+        "ai_response": None,
+        "image_url": None,
+        "cached": False,
+        "record_saved": False,
+        "error": None,
+        "warning": None,
+        "preprocess": None,
+        "record": None,
+    }
+
+
+def run_diagnosis(client, uid, upload, pattern, settings):
+    """1枚のバナーについて キャッシュ確認 → Storageアップロード＋AI採点（並行） を行う。
+    upload は uploads.open_image_bytes / load_uploaded_image が返す辞書。
+    Firestoreには書かず、記録データを result["record"] に入れて返す（commit_diagnoses で利用回数と一緒に保存する）。
+    ワーカースレッドから呼ばれるため画面描画はせず、結果を辞書で返す"""
+    result = new_result(pattern)
+
+    # 薬機法の対象業種は、採点と薬機法チェックを1回のリクエストで行う
+    include_compliance = yakujihou.needs_yakujihou_check(settings["industry"])
+
+    # 同じ画像・同じ条件なら保存済みの診断を使う（アップロードもLLM呼び出しもしない）
+    cache_key = diagnosis_cache.make_cache_key(
+        upload["data"],
+        settings["age_group"],
+        settings["purpose"],
+        settings["score_format"],
+        settings["platform"],
+        settings["industry"],
+        scoring.PROMPT_VERSION,
+    )
+    cached = diagnosis_cache.get_cached_diagnosis(cache_key, auth_utils.db)
+
+    if cached and cached.get("image"):
+        result["cached"] = True
+        stored_image = cached["image"]
+        content = cached["ai_response"]
+    else:
+        # PNG/JPEGは再エンコードせず、アップロードされたバイト列をそのまま保存する
+        storage_data, content_type, extension = uploads.storage_payload(upload)
+        # Storageへのアップロードは別スレッドで走らせ、その間にAI採点を行う
+        upload_future = get_upload_executor().submit(
+            auth_utils.upload_image_to_firebase_storage,
+            io.BytesIO(storage_data),
+            extension,
+            content_type,
+        )
+
+        # AIには縮小・再圧縮した画像を送る（Storageには元の解像度で保存）
+        vision_image = image_preprocess.prepare_vision_image(upload["data"])
+        result["preprocess"] = vision_image
+
+        try:
+            content = scoring.request_scoring(
+                client,
+                vision_image["data"],
+                settings["age_group"],
+                settings["purpose"],
+                settings["score_format"],
+                mime_type=vision_image["mime_type"],
+                detail=vision_image["detail"],
+                include_compliance=include_compliance,
+                uid=uid,
+                plan=settings.get("plan"),
+            )
+        except Exception as e:
+            result["score"] = "エラー"
+            result["comment"] = "AI応答エラー"
+            result["error"] = f"AI採点中にエラーが発生しました（{pattern}パターン）: {str(e)}"
+            return result
+
+        try:
+            stored_image = upload_future.result()
+        except Exception:
+            stored_image = None
+        if not stored_image:
+            # アップロード失敗でも採点結果は表示・記録する
+            result["warning"] = "画像のアップロードに失敗しました。診断結果は画像なしで記録します。"
+
+    stored_image = stored_image or {}
+    result["image_url"] = auth_utils.get_signed_image_url(stored_image.get("image_path"))
+    result["ai_response"] = content
+    result["score"], result["comment"], result["criteria"] = scoring.parse_scoring_response(content)
+    if scoring.PARSE_FAILED in (result["score"], result["comment"]):
+        # 拒否応答（content が None）や読み取れない応答は記録せず、利用回数も消費しない（予約は返却される）
+        result["score"] = "エラー"
+        result["comment"] = "AI応答エラー"
+        result["error"] = f"AIの応答からスコアまたは改善コメントを読み取れませんでした（{pattern}パターン）。この診断は利用回数に含まれません。"
+        return result
+    if include_compliance:
+        result["yakujihou"] = scoring.parse_compliance_result(content)
+
+    if llm_backends.is_live(client) and stored_image and not result["cached"]:
+        diagnosis_cache.store_diagnosis(cache_key, {
+            "ai_response": content,
+            "image": stored_image,
+        }, auth_utils.db)
+
+    firestore_record_data = {
+        "platform": sanitize(settings["platform"]),
+        "category": sanitize(settings["category"]),
+        "industry": sanitize(settings["industry"]),
+        "genre": sanitize(settings.get("genre", "")),
+        "banner_name": sanitize(settings.get("banner_name", "")),
+        "age_group": sanitize(settings["age_group"]),
+        "purpose": sanitize(settings["purpose"]),
+        "score": sanitize(result["score"]),
+        "comment": sanitize(result["comment"]),
+        "criteria": result["criteria"],
+        "yakujihou": result["yakujihou"],
+        "result": sanitize(settings["result"]),
+        "follower_gain": sanitize(settings["follower_gain"]),
+        "memo": sanitize(settings["memo"]),
+        "prompt_version": scoring.PROMPT_VERSION,
+        # 署名URLは期限切れになるので、記録にはStorageのパスを残す
+        "image_path": stored_image.get("image_path"),
+        "thumbnail_path": stored_image.get("thumbnail_path"),
+    }
+    result["record"] = firestore_record_data
+    return result
+
+
+@st.cache_resource
+def get_diagnosis_executor():
+    """診断パイプライン用のスレッドプールを返す（プロセス内で1つだけ作る）"""
+    return ThreadPoolExecutor(max_workers=DIAGNOSIS_MAX_WORKERS, thread_name_prefix="diagnosis")
+
+
+@st.cache_resource
+def get_upload_executor():
+    """Storageアップロード用のスレッドプールを返す（診断用プールとは分けてデッドロックを防ぐ）"""
+    return ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS, thread_name_prefix="upload")
+
+
+def run_diagnoses(client, uid, jobs, settings):
+    """複数の (パターン, アップロード画像) を並行して診断し、パターンごとの結果を返す"""
+    executor = get_diagnosis_executor()
+    futures = {
+        pattern: executor.submit(run_diagnosis, client, uid, upload, pattern, settings)
+        for pattern, upload in jobs
+    }
+    return {pattern: future.result() for pattern, future in futures.items()}
+
+
+def commit_diagnoses(reservation, results):
+    """予約した利用回数を、記録できる診断（エラーでないもの）の数だけ確定し、その記録を同じバッチで保存する。
+    エラーになった分の予約は返却される"""
+    results = [result for result in results if result["record"]]
+    saved = auth_utils.commit_uses_in_firestore(reservation, len(results), [result["record"] for result in results])
+    for result in results:
+        result["record_saved"] = saved
+    return saved
+
+
+def iter_diagnoses(client, uid, upload_list, settings, concurrency):
+    """複数画像を最大 concurrency 並行で診断し、終わった順に (インデックス, 結果) を返す"""
+    concurrency = max(1, min(concurrency, BULK_MAX_CONCURRENCY))
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk")
+    futures = {
+        executor.submit(run_diagnosis, client, uid, upload, f"BULK{index + 1:03d}", settings): index
+        for index, upload in enumerate(upload_list)
+    }
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = new_result(f"BULK{index + 1:03d}")
+                result["score"] = "エラー"
+                result["error"] = f"診断中にエラーが発生しました: {str(e)}"
+            yield index, result
+    finally:
+        # 途中で止められた（再実行・停止でジェネレータが閉じられた）場合は、未着手の診断を取り消す。
+        # 実行中のものは待たずに戻る（予約は呼び出し側で返却される）
+        executor.shutdown(wait=False, cancel_futures=True)
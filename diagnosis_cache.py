@@ -0,0 +1,120 @@
+# diagnosis_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import streamlit as st
+
+# --- キャッシュ設定 ---
+# 同じバナー・同じ条件での再診断は、LLM呼び出しとStorageアップロードを省略して保存済みの結果を返す
+CACHE_TTL_SECONDS = int(os.getenv("DIAGNOSIS_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+CACHE_MAX_ENTRIES = int(os.getenv("DIAGNOSIS_CACHE_MAX_ENTRIES", "512"))
+FIRESTORE_CACHE_COLLECTION = "diagnosis_cache"
+
+
+def make_cache_key(image_bytes, age_group, purpose, score_format, platform, industry, prompt_version=""):
+    """画像バイト列のハッシュと採点パラメータ（プロンプトのバージョンを含む）からキャッシュキーを作る"""
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    params = json.dumps([age_group, purpose, score_format, platform, industry, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(f"{image_hash}:{params}".encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    """有効期限つきのLRUキャッシュ（プロセス内・スレッドセーフ）"""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@st.cache_resource
+def get_memory_cache():
+    """プロセス内で共有されるキャッシュ（第1層）を返す"""
+    return LRUTTLCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+
+
+def get_cached_diagnosis(cache_key, db=None):
+    """キャッシュから診断結果を取得する。プロセス内 → Firestore の順に探し、なければNoneを返す"""
+    memory_cache = get_memory_cache()
+    cached = memory_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    if db is None:
+        return None
+
+    # 第2層：Firestore（インスタンス間で共有）
+    try:
+        doc_ref = db.collection(FIRESTORE_CACHE_COLLECTION).document(cache_key)
+        doc = doc_ref.get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        expires_at = data.get("expires_at")
+        now = datetime.now(timezone.utc)
+        if expires_at is None or expires_at < now:
+            return None
+        result = data.get("result")
+        if not result:
+            return None
+
+        # ヒットしたエントリは有効期限を延長する（使われないエントリから期限切れになる＝近似LRU）
+        doc_ref.update({
+            "expires_at": now + timedelta(seconds=CACHE_TTL_SECONDS),
+            "last_accessed_at": now,
+        })
+        memory_cache.set(cache_key, result)
+        return result
+    except Exception:
+        # キャッシュの失敗で診断自体を止めない
+        return None
+
+
+def store_diagnosis(cache_key, result, db=None):
+    """診断結果を両方の層に保存する"""
+    get_memory_cache().set(cache_key, result)
+
+    if db is None:
+        return
+
+    try:
+        now = datetime.now(timezone.utc)
+        db.collection(FIRESTORE_CACHE_COLLECTION).document(cache_key).set({
+            "result": result,
+            "created_at": now,
+            "last_accessed_at": now,
+            # FirestoreのTTLポリシーをこのフィールドに設定すると期限切れドキュメントが自動削除される
+            "expires_at": now + timedelta(seconds=CACHE_TTL_SECONDS),
+        })
+    except Exception:
+        pass
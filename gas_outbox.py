@@ -0,0 +1,123 @@
+# gas_outbox.py
+"""Google Apps Script（スプレッドシート記録）への送信を、ローカルのSQLiteキュー経由で非同期に行う。
+
+画面側は enqueue() でキューに積むだけで、GASの応答を待たない。
+送信はバックグラウンドのワーカーがまとめて行い、失敗したものは間隔を空けて再送する。
+プロセスが落ちてもキューはファイルに残るので、次に起動したときに続きから送られる。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+import clients
+
+GAS_OUTBOX_PATH = os.getenv("GAS_OUTBOX_PATH", ".gas_outbox.sqlite3")
+GAS_OUTBOX_BATCH_SIZE = int(os.getenv("GAS_OUTBOX_BATCH_SIZE", "20"))
+GAS_OUTBOX_FLUSH_SECONDS = float(os.getenv("GAS_OUTBOX_FLUSH_SECONDS", "5"))
+GAS_OUTBOX_MAX_ATTEMPTS = int(os.getenv("GAS_OUTBOX_MAX_ATTEMPTS", "8"))
+GAS_OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("GAS_OUTBOX_BACKOFF_MAX_SECONDS", "600"))
+
+
+class GasOutbox:
+    """SQLiteに保存する送信待ちキューと、それを送るワーカースレッド"""
+
+    def __init__(self, path=GAS_OUTBOX_PATH):
+        self.path = path
+        self.wakeup = threading.Event()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (attempts, next_attempt_at)")
+        self.worker = threading.Thread(target=self._run, name="gas-outbox", daemon=True)
+        self.worker.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def enqueue(self, url, payload):
+        """送信データをキューに積む（すぐに戻る）"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO outbox (url, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(payload, ensure_ascii=False), now, now),
+            )
+        self.wakeup.set()
+
+    def pending_count(self):
+        """送信待ち（再送待ちを含む）の件数を返す"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE attempts < ?", (GAS_OUTBOX_MAX_ATTEMPTS,)
+            ).fetchone()[0]
+
+    def flush(self):
+        """送信できる状態のものを最大 GAS_OUTBOX_BATCH_SIZE 件送る。送った件数を返す"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, url, payload, attempts FROM outbox"
+                " WHERE attempts < ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (GAS_OUTBOX_MAX_ATTEMPTS, time.time(), GAS_OUTBOX_BATCH_SIZE),
+            ).fetchall()
+
+        sent = []
+        failed = []
+        for row_id, url, payload, attempts in rows:
+            try:
+                # GASのdoPostは1回に1件を受け取るので、接続を使い回して順に送る
+                response = clients.http_post(
+                    clients.GAS,
+                    url,
+                    data=payload.encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                )
+                response.raise_for_status()
+                sent.append((row_id,))
+            except Exception as e:
+                delay = min(GAS_OUTBOX_BACKOFF_MAX_SECONDS, GAS_OUTBOX_FLUSH_SECONDS * 2 ** attempts)
+                failed.append((time.time() + delay, str(e)[:500], row_id))
+
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", sent)
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                failed,
+            )
+        return len(sent)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(GAS_OUTBOX_FLUSH_SECONDS)
+            self.wakeup.clear()
+            try:
+                # 1回分送り切ったら、残りがあれば続けて送る
+                while self.flush() >= GAS_OUTBOX_BATCH_SIZE:
+                    pass
+            except Exception:
+                # キューのファイルに触れない場合なども、ワーカーは止めずに次の周期で再試行する
+                pass
+
+
+@st.cache_resource
+def get_outbox():
+    """プロセス全体で共有するキュー（とワーカー）を返す"""
+    return GasOutbox()
+
+
+def enqueue(url, payload):
+    """GASへの送信をキューに積む"""
+    get_outbox().enqueue(url, payload)
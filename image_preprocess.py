@@ -0,0 +1,135 @@
+# image_preprocess.py
+import io
+import math
+import os
+
+from PIL import Image
+
+# --- GPT-4o vision に送る画像の前処理設定 ---
+# Storageには元画像を保存し、ここでの縮小・再圧縮はAIへの送信データにだけ適用する
+VISION_MAX_LONG_EDGE = int(os.getenv("VISION_MAX_LONG_EDGE", "1024"))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG").upper()  # JPEG / WEBP / PNG
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+VISION_DETAIL = os.getenv("VISION_DETAIL", "auto")  # low / high / auto
+# 縮小不要でこのサイズ以下なら、元のバイト列をそのまま送る
+VISION_PASSTHROUGH_BYTES = int(os.getenv("VISION_PASSTHROUGH_BYTES", str(512 * 1024)))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+# --- 一覧表示用サムネイルの設定（Storageに元画像と並べて保存する） ---
+THUMBNAIL_MAX_LONG_EDGE = int(os.getenv("THUMBNAIL_MAX_LONG_EDGE", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "75"))
+
+
+def estimate_vision_tokens(width, height, detail="auto"):
+    """OpenAIの画像トークン計算式に沿って、画像1枚あたりの入力トークン数を見積もる"""
+    if detail == "low":
+        return 85
+
+    # 2048x2048に収まるよう縮小 → 短辺を768に縮小 → 512pxタイルの枚数で計算
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def _to_rgb(image):
+    """透過画像を白背景に合成してRGBにする（JPEGは透過を扱えないため）"""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def make_thumbnail(data, max_long_edge=None, quality=None):
+    """画像のバイト列から一覧表示用のWebPサムネイル（バイト列）を作る"""
+    image = Image.open(io.BytesIO(data))
+    # JPEGはデコード時に縮小できるので、大きな画像でも全画素を展開しない
+    max_long_edge = max_long_edge or THUMBNAIL_MAX_LONG_EDGE
+    image.draft("RGB", (max_long_edge, max_long_edge))
+    image = image.convert("RGBA") if image.mode in ("RGBA", "LA", "P") else image.convert("RGB")
+    image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format="WEBP", quality=quality or THUMBNAIL_QUALITY, method=4)
+    return output.getvalue()
+
+
+def prepare_vision_image(original_data,
+                         max_long_edge=None, image_format=None, quality=None, detail=None):
+    """AIに送る画像を縮小・再圧縮し、送信データと削減量を辞書で返す。
+
+    original_data はアップロードされた元のバイト列。画像はこの関数の中だけで開き、展開した画素は呼び出し側に残さない。
+    縮小も形式変換も不要な場合は元のバイト列をそのまま使う。縮小が不要で、再圧縮しても小さくならない場合
+    （PNGのスクリーンショットなど）も元のバイト列を使う。
+    """
+    max_long_edge = max_long_edge or VISION_MAX_LONG_EDGE
+    image_format = (image_format or VISION_IMAGE_FORMAT).upper()
+    quality = quality or VISION_IMAGE_QUALITY
+    detail = detail or VISION_DETAIL
+    if image_format not in MIME_TYPES:
+        image_format = "JPEG"
+
+    image = Image.open(io.BytesIO(original_data))
+    original_width, original_height = image.size
+    needs_resize = max(original_width, original_height) > max_long_edge
+    passthrough = (
+        not needs_resize
+        and image.format in MIME_TYPES
+        and (image.format == image_format or len(original_data) <= VISION_PASSTHROUGH_BYTES)
+    )
+
+    if passthrough:
+        processed_size = image.size
+        data = original_data
+        mime_type = MIME_TYPES[image.format]
+    else:
+        processed = image
+        if needs_resize:
+            # JPEGはデコード時に縮小できるので、大きな画像でも全画素を展開しない
+            processed.draft("RGB", (max_long_edge, max_long_edge))
+            processed.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            _to_rgb(processed).save(output, format="JPEG", quality=quality, optimize=True)
+        elif image_format == "WEBP":
+            processed.save(output, format="WEBP", quality=quality, method=4)
+        else:
+            processed.save(output, format="PNG", optimize=True)
+        processed_size = processed.size
+        data = output.getvalue()
+        mime_type = MIME_TYPES[image_format]
+        if not needs_resize and image.format in MIME_TYPES and len(data) >= len(original_data):
+            passthrough = True
+            data = original_data
+            mime_type = MIME_TYPES[image.format]
+
+    original_tokens = estimate_vision_tokens(original_width, original_height, "auto")
+    tokens = estimate_vision_tokens(processed_size[0], processed_size[1], detail)
+    return {
+        "data": data,
+        "mime_type": mime_type,
+        "detail": detail,
+        "passthrough": passthrough,
+        "size": processed_size,
+        "original_size": (original_width, original_height),
+        "original_bytes": len(original_data),
+        "bytes": len(data),
+        "original_tokens": original_tokens,
+        "tokens": tokens,
+    }
+
+
+def format_savings(prepared):
+    """前処理による削減量を表示用の文字列にする"""
+    original_kb = prepared["original_bytes"] / 1024
+    sent_kb = prepared["bytes"] / 1024
+    ratio = 1 - prepared["bytes"] / prepared["original_bytes"] if prepared["original_bytes"] else 0
+    return (
+        f"AI送信画像: {original_kb:,.0f}KB → {sent_kb:,.0f}KB（{-ratio:+.0%}） / "
+        f"推定画像トークン: {prepared['original_tokens']} → {prepared['tokens']}（detail={prepared['detail']}）"
+    )
@@ -0,0 +1,234 @@
+# llm_backends.py
+"""LLMの呼び出し先（バックエンド）。どれも OpenAI SDK と同じ client.chat.completions.create(...) で呼べる。
+
+- openai: 本物のOpenAI API（OPENAI_API_KEY が必要）
+- fake:   プロセス内で決まった応答を返す偽クライアント（APIキーなしのデモモード・オフライン試験用）
+- local:  mock_llm_server.py（chat-completions 互換のローカルサーバー）に OpenAI SDK で接続する。
+          遅延・エラー率・ストリーミングをサーバー側で変えられるので、通信を含めた負荷試験に使う
+
+環境変数 LLM_BACKEND で切り替える（既定: openai）。
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+
+import httpx
+from openai import OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+import llm_scheduler
+import prompts
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://127.0.0.1:8765/v1")
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0"))
+
+# --- OpenAIクライアントの接続プール・タイムアウト設定 ---
+# プロセス内で1つのクライアントを共有し、keep-alive接続を使い回してTLSハンドシェイクを省く
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "20"))
+
+# リトライは llm_scheduler 側でまとめて行う（SDK内蔵のリトライと二重にならないようにする）
+OPENAI_SDK_MAX_RETRIES = 0
+
+BACKENDS = ("openai", "fake", "local")
+
+
+def create_openai_client(api_key, base_url=None):
+    """接続プールを設定したOpenAIクライアントを作る。base_url を渡すと互換サーバーに接続する"""
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=OPENAI_POOL_SIZE,
+            max_keepalive_connections=OPENAI_POOL_SIZE,
+        ),
+        timeout=OPENAI_TIMEOUT_SECONDS,
+    )
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        timeout=OPENAI_TIMEOUT_SECONDS,
+        max_retries=OPENAI_SDK_MAX_RETRIES,
+    )
+
+
+def create_client(backend=LLM_BACKEND):
+    """指定したバックエンドのクライアントを作る。openai でAPIキーが未設定ならNone"""
+    if backend == "fake":
+        return FakeOpenAIClient(latency=FAKE_LLM_LATENCY_SECONDS)
+    if backend == "local":
+        # ローカルサーバーはキーを検証しないが、SDKは空のキーを受け付けない
+        return create_openai_client("local", base_url=LOCAL_LLM_BASE_URL)
+    if backend != "openai":
+        raise ValueError(f"LLM_BACKEND は {' / '.join(BACKENDS)} のいずれかを指定してください: {backend}")
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    return create_openai_client(api_key)
+
+
+def is_live(client):
+    """本物のOpenAI APIに接続するクライアントかどうか（偽の応答をキャッシュ・集計に混ぜないために使う）"""
+    return isinstance(client, OpenAI) and client.base_url.host == "api.openai.com"
+
+
+# --- 決まった応答の生成（fake と mock_llm_server.py で共通） ---
+FAKE_MODEL = "fake-gpt-4o"
+
+FAKE_SCORING_COMMENTS = [
+    "プロフェッショナルなデザインで非常に優秀です。視覚的インパクトが強く、ターゲットに効果的に訴求できています。",
+    "究極のプロフェッショナルデザイン。視覚的インパクトが最高レベルで、ターゲットへの訴求力が抜群です。",
+    "訴求内容は伝わりますが、文字量が多く視線が散ります。キャッチコピーを1行に絞り、CTAボタンを目立たせましょう。",
+    "写真とコピーの方向性は合っています。背景とのコントラストを上げ、コピーを大きくすると一瞬で伝わります。",
+]
+FAKE_COMPLIANCE = {"verdict": "OK", "reason": "デモ応答のため問題なしとしています。"}
+FAKE_YAKUJIHOU_RESULT = "OK - デモモードでは問題なし"
+FAKE_AB_COMPARE_RESULT = """---
+総合評価: Bパターンが優れている
+理由: プロフェッショナルなデザインレベルが高く、視覚的インパクトと訴求力のバランスが最適。ターゲットへの効果的なアプローチが実現されている。
+今後の改善提案:
+1. さらなる高級感を演出するためのエフェクト強化
+2. ターゲット層により特化したメッセージング最適化
+---"""
+
+_TEMPLATES_BY_SYSTEM = {
+    template.system: template.name
+    for template in (prompts.SCORING, prompts.YAKUJIHOU, prompts.AB_COMPARE, prompts.COPY)
+}
+
+
+def _request_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                parts.append(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                parts.append(str(part.get("image_url")))
+    return "\n".join(parts)
+
+
+def _fake_scoring(schema, seed):
+    properties = schema.get("properties", {})
+    score = properties.get("score", {})
+    if score.get("type") == "integer":
+        value = 60 + seed[0] % 36
+    else:
+        value = score.get("enum", prompts.GRADES)[seed[0] % 6]
+    result = {
+        "score": value,
+        "criteria": {
+            key: prompts.CRITERION_MAX - seed[i + 1] % 3
+            for i, key in enumerate(properties.get("criteria", {}).get("properties", {}))
+        },
+        "comment": FAKE_SCORING_COMMENTS[seed[-1] % len(FAKE_SCORING_COMMENTS)],
+    }
+    if "yakujihou" in properties:
+        result["yakujihou"] = FAKE_COMPLIANCE
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _fake_copy(request_text):
+    lines = []
+    for label, count in re.findall(r"\*\*(.+?)\*\*：(\d+)案", request_text):
+        lines.append(f"## {label}")
+        lines.extend(f"{i}. {label}のデモ案{i}" for i in range(1, int(count) + 1))
+        lines.append("")
+    caption_lines = re.search(r"改行で(\d+)行の投稿文", request_text)
+    if caption_lines:
+        lines.append("## 投稿文")
+        lines.extend(f"{i}) 投稿文のデモ{i}行目です。" for i in range(1, int(caption_lines.group(1)) + 1))
+    return "\n".join(lines).strip() or "（デモ応答）"
+
+
+def fake_completion_content(request):
+    """chat.completions のリクエスト（辞書）に対する決まった応答テキストを返す。同じリクエストには同じ応答"""
+    messages = request.get("messages", [])
+    system = next((m.get("content") for m in messages if m.get("role") == "system"), "")
+    template = _TEMPLATES_BY_SYSTEM.get(system)
+    request_text = _request_text(messages)
+    seed = hashlib.sha256(request_text.encode("utf-8")).digest()
+
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return _fake_scoring(response_format["json_schema"].get("schema", {}), seed)
+    if template == "yakujihou":
+        return FAKE_YAKUJIHOU_RESULT
+    if template == "ab_compare":
+        return FAKE_AB_COMPARE_RESULT
+    if template == "copy":
+        return _fake_copy(request_text)
+    return "（デモ応答）"
+
+
+def fake_completion(request):
+    """ChatCompletion と同じ形の応答（辞書）を返す"""
+    content = fake_completion_content(request)
+    prompt_tokens = llm_scheduler.estimate_tokens(request.get("messages", []))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": FAKE_MODEL,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_tokens + len(content),
+        },
+    }
+
+
+def fake_completion_chunks(completion, chunk_size=8):
+    """応答（辞書）を ChatCompletionChunk と同じ形の辞書に分割する（ストリーミング用）"""
+    content = completion["choices"][0]["message"]["content"]
+
+    def chunk(delta, finish_reason=None):
+        return {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    yield chunk({"role": "assistant", "content": ""})
+    for start in range(0, len(content), chunk_size):
+        yield chunk({"content": content[start:start + chunk_size]})
+    yield chunk({}, "stop")
+
+
+class _FakeCompletions:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, stream=False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        completion = fake_completion(kwargs)
+        if stream:
+            return (ChatCompletionChunk.model_validate(chunk) for chunk in fake_completion_chunks(completion))
+        return ChatCompletion.model_validate(completion)
+
+
+class _FakeChat:
+    def __init__(self, latency):
+        self.completions = _FakeCompletions(latency)
+
+
+class FakeOpenAIClient:
+    """通信せずに決まった応答を返す、OpenAIクライアントの代わり（chat.completions.create のみ）"""
+
+    def __init__(self, latency=0.0):
+        self.chat = _FakeChat(latency)
@@ -0,0 +1,200 @@
+# llm_scheduler.py
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import openai
+import streamlit as st
+
+# --- レート制限（組織のOpenAI上限に合わせて設定する） ---
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "30000"))
+
+# --- リトライ設定 ---
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "1"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "30"))
+
+# 同時実行枠が空くまで待つ最大秒数（超えたら混雑エラーにする）
+SLOT_WAIT_SECONDS = float(os.getenv("OPENAI_SLOT_WAIT_SECONDS", "120"))
+
+# プランごとの同時実行数の上限（1ユーザーあたり / プラン全体）
+PLAN_USER_IN_FLIGHT = {"Guest": 1, "Free": 1, "Light": 2, "Pro": 4, "Team": 8, "Enterprise": 8}
+PLAN_TOTAL_IN_FLIGHT = {"Guest": 4, "Free": 8, "Light": 16, "Pro": 24, "Team": 24, "Enterprise": 32}
+DEFAULT_USER_IN_FLIGHT = 1
+DEFAULT_TOTAL_IN_FLIGHT = 8
+
+# 画像1枚あたりのトークン見積もり（detail=high・1024px相当）
+IMAGE_TOKEN_ESTIMATE = 765
+
+# リトライする例外（レート制限・一時的なサーバー/通信エラー）
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class SchedulerBusyError(RuntimeError):
+    """同時実行枠が時間内に空かなかった"""
+
+
+class TokenBucket:
+    """一定の速度で補充されるバケツ。取り出せるまで待つ"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.available = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """amount 分を取り出す。足りなければ補充されるまで待つ（容量を超える量は容量に丸める）"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """見積もりと実際の差を戻す（正なら返却、負なら追加で消費）"""
+        with self.lock:
+            self._refill()
+            self.available = min(self.capacity, self.available + amount)
+
+    def pause(self, seconds):
+        """Retry-After を受けたとき、全体の送信をしばらく止める"""
+        with self.lock:
+            self._refill()
+            self.available = min(self.available, 0.0) - seconds * self.rate
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """リクエストのトークン数をざっくり見積もる（日本語は1文字≒1トークン、画像は1枚あたり固定値）"""
+    total = max_tokens or 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+def retry_after_seconds(error):
+    """エラー応答の Retry-After（retry-after-ms / retry-after）を秒で返す。なければNone"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def backoff_seconds(attempt):
+    """ジッター付き指数バックオフ（full jitter）の待ち時間を返す"""
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX_SECONDS, OPENAI_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+class RequestScheduler:
+    """OpenAI呼び出しを、レート制限・同時実行数の上限・リトライ付きで実行する（プロセス内で共有）"""
+
+    def __init__(self, rpm_limit=OPENAI_RPM_LIMIT, tpm_limit=OPENAI_TPM_LIMIT, max_retries=OPENAI_MAX_RETRIES):
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.user_slots = {}
+        self.plan_slots = {}
+
+    def _semaphore(self, slots, key, limit):
+        with self.lock:
+            if key not in slots:
+                slots[key] = threading.BoundedSemaphore(limit)
+            return slots[key]
+
+    @contextmanager
+    def slot(self, uid=None, plan=None):
+        """ユーザー・プランの同時実行枠を確保する。uidがNone（CLIなど）の場合は枠の制限をかけない"""
+        if uid is None:
+            yield
+            return
+        plan_slot = self._semaphore(self.plan_slots, plan, PLAN_TOTAL_IN_FLIGHT.get(plan, DEFAULT_TOTAL_IN_FLIGHT))
+        user_slot = self._semaphore(self.user_slots, uid, PLAN_USER_IN_FLIGHT.get(plan, DEFAULT_USER_IN_FLIGHT))
+        if not user_slot.acquire(timeout=SLOT_WAIT_SECONDS):
+            raise SchedulerBusyError("同時に実行できるAIリクエスト数の上限に達しています。しばらくしてから再度お試しください。")
+        try:
+            if not plan_slot.acquire(timeout=SLOT_WAIT_SECONDS):
+                raise SchedulerBusyError("AIリクエストが混み合っています。しばらくしてから再度お試しください。")
+            try:
+                yield
+            finally:
+                plan_slot.release()
+        finally:
+            user_slot.release()
+
+    def call_with_retries(self, request, estimated_tokens, **kwargs):
+        """レート制限に従って request(**kwargs) を呼ぶ。一時的なエラーはバックオフして再試行する"""
+        for attempt in range(self.max_retries + 1):
+            self.requests.acquire()
+            self.tokens.acquire(estimated_tokens)
+            try:
+                response = request(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                # 失敗したリクエストはトークンを消費していないので、見積もり分を返してから再試行する
+                self.tokens.adjust(min(estimated_tokens, self.tokens.capacity))
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    # サーバーの指示がある場合はそれに従う。バケツを止めるので他のリクエストも同じだけ待つ
+                    self.requests.pause(retry_after)
+                else:
+                    time.sleep(backoff_seconds(attempt))
+                continue
+
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                self.tokens.adjust(estimated_tokens - usage.total_tokens)
+            return response
+
+    def create_chat_completion(self, client, uid=None, plan=None, **kwargs):
+        """client.chat.completions.create をスケジューラ経由で呼ぶ（ストリーミングは下の stream_chat_completion を使う）"""
+        estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        with self.slot(uid, plan):
+            return self.call_with_retries(client.chat.completions.create, estimated, **kwargs)
+
+    def stream_chat_completion(self, client, uid=None, plan=None, **kwargs):
+        """ストリーミング応答をスケジューラ経由で開始し、チャンクを順に返す。
+        同時実行枠は最後のチャンクを受け取るまで確保したままにする"""
+        estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        with self.slot(uid, plan):
+            stream = self.call_with_retries(client.chat.completions.create, estimated, stream=True, **kwargs)
+            yield from stream
+
+
+@st.cache_resource
+def get_scheduler():
+    """プロセス全体で共有するスケジューラを返す"""
+    return RequestScheduler()
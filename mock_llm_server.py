@@ -0,0 +1,128 @@
+# mock_llm_server.py
+"""OpenAI の chat-completions API を真似るローカルサーバー（負荷試験・オフライン確認用）。
+
+使い方:
+    python mock_llm_server.py --port 8765 --latency 1.2 --jitter 0.5 --error-rate 0.02 --rate-limit-rate 0.05
+    LLM_BACKEND=local streamlit run streamlit_app.py
+
+応答の中身は llm_backends の偽クライアントと同じ（同じリクエストには同じ応答）。
+--latency / --jitter で応答までの時間、--error-rate で 500、--rate-limit-rate で Retry-After 付きの 429 を返す割合、
+--chunk-delay / --chunk-size でストリーミング（stream: true）の速さを変えられる。
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import llm_backends
+
+COMPLETIONS_PATHS = ("/v1/chat/completions", "/chat/completions")
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    # keep-alive を有効にして、本物のAPIと同じく接続プールが使い回される状態にする
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def log_message(self, format, *args):
+        if not self.options.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, error_type, message, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": error_type, "param": None, "code": None}}, headers)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_stream(self, completion):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in llm_backends.fake_completion_chunks(completion, self.options.chunk_size):
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if self.options.chunk_delay:
+                time.sleep(self.options.chunk_delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.split("?")[0] not in COMPLETIONS_PATHS:
+            self._send_error(404, "invalid_request_error", f"Unknown path: {self.path}")
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self._send_error(400, "invalid_request_error", "Request body is not valid JSON.")
+            return
+
+        options = self.options
+        time.sleep(max(0.0, options.latency + random.uniform(-options.jitter, options.jitter)))
+        roll = random.random()
+        if roll < options.rate_limit_rate:
+            self._send_error(
+                429, "rate_limit_error", "Rate limit reached (mock).",
+                headers={"Retry-After": f"{options.retry_after:g}"},
+            )
+            return
+        if roll < options.rate_limit_rate + options.error_rate:
+            self._send_error(500, "server_error", "The server had an error (mock).")
+            return
+
+        completion = llm_backends.fake_completion(request)
+        if request.get("stream"):
+            self._send_stream(completion)
+        else:
+            self._send_json(200, completion)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="chat-completions 互換のローカルサーバーを起動します。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="応答までの平均秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="応答時間のばらつき（±秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 を返す割合（0〜1）")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429 を返す割合（0〜1）")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 の Retry-After 秒数")
+    parser.add_argument("--chunk-size", type=int, default=8, help="ストリーミング1チャンクあたりの文字数")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="ストリーミングのチャンク間隔（秒）")
+    parser.add_argument("--quiet", action="store_true", help="リクエストごとのログを出さない")
+    return parser.parse_args(argv)
+
+
+def make_server(options):
+    """設定を持たせたサーバーを作る（serve_forever() で起動する）"""
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {"options": options})
+    return ThreadingHTTPServer((options.host, options.port), handler)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    server = make_server(options)
+    print(f"mock LLM server: http://{options.host}:{options.port}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,142 @@
-import streamlit as st
 import pandas as pd
+import streamlit as st
+
+import auth_utils  # Firebase 認証/診断履歴
+import theme
 
 st.set_page_config(page_title="実績記録", layout="wide")
-st.title("📋 バナスコ｜広告実績記録ページ")
+theme.inject_theme()
+auth_utils.check_login()
+st.title("📋 バナスコ｜診断履歴")
+
+# 1ページあたりの表示件数
+HISTORY_PAGE_SIZE = 20
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_summary(uid):
+    # 集計ドキュメント1件を読むだけ（履歴の件数に関係なく一定）
+    return auth_utils.get_diagnosis_rollup(uid)
+
+
+# ---------------------------
+# サマリー
+# ---------------------------
+try:
+    summary = load_summary(st.session_state.user)
+except Exception as e:
+    summary = None
+    st.warning(f"集計の取得に失敗しました: {e}")
 
-# データ取得（例：Google Sheets or 仮データ）
-# 仮データで構築
-if "records" not in st.session_state:
-    st.session_state["records"] = [
+if summary and summary["count"]:
+    metric_cols = st.columns(4)
+    metric_cols[0].metric("診断数", summary["count"])
+    metric_cols[1].metric(
+        "平均フォロワー増加数",
+        f"{summary['avg_follower_gain']:.1f}" if summary["avg_follower_gain"] is not None else "-"
+    )
+    metric_cols[2].metric("A/B比較数", summary["ab_count"])
+    metric_cols[3].metric(
+        "A/B勝率（A / B）",
+        f"{summary['ab_a_win_rate']:.0%} / {summary['ab_b_win_rate']:.0%}" if summary["ab_count"] else "-"
+    )
+
+    with st.expander("📊 スコア分布"):
+        tabs = st.tabs(["全体", "媒体別", "業種別", "ジャンル別"])
+        with tabs[0]:
+            st.bar_chart(pd.Series(summary["scores"], name="件数"))
+        for tab, key in zip(tabs[1:], ["by_platform", "by_industry", "by_genre"]):
+            with tab:
+                st.dataframe(
+                    [{"区分": name, "件数": group.get("count", 0), **group.get("scores", {})}
+                     for name, group in summary[key].items()],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
+# ---------------------------
+# 絞り込み条件
+# ---------------------------
+filter_cols = st.columns(3)
+with filter_cols[0]:
+    platform = st.selectbox("媒体", ["すべて", "Instagram", "GDN", "YDN"], key="history_platform")
+with filter_cols[1]:
+    industry = st.selectbox("業種", ["すべて", "美容", "飲食", "不動産", "子ども写真館", "その他"], key="history_industry")
+with filter_cols[2]:
+    score = st.text_input("スコア（完全一致）", placeholder="例: A+ / 85", key="history_score").strip()
+
+filters = {
+    "platform": None if platform == "すべて" else platform,
+    "industry": None if industry == "すべて" else industry,
+    "score": score or None,
+}
+
+# 条件が変わったら1ページ目に戻す。
+# history_cursors[n] は n+1 ページ目の開始位置（nページ目の最後のスナップショット）
+if st.session_state.get("history_filters") != filters:
+    st.session_state.history_filters = filters
+    st.session_state.history_cursors = [None]
+    st.session_state.history_page = 0
+    st.session_state.pop("history_cache", None)
+
+page = st.session_state.history_page
+cache_key = (tuple(filters.items()), page)
+cached = st.session_state.get("history_cache")
+if cached and cached[0] == cache_key:
+    records, last_snapshot, has_next = cached[1]
+else:
+    # 読むのは常に1ページ分（＋次ページ判定の1件）だけ
+    try:
+        records, last_snapshot, has_next = auth_utils.get_diagnosis_history_page(
+            st.session_state.user,
+            filters,
+            HISTORY_PAGE_SIZE,
+            st.session_state.history_cursors[page]
+        )
+    except Exception as e:
+        st.error(f"診断履歴の取得に失敗しました: {e}")
+        st.stop()
+    st.session_state.history_cache = (cache_key, (records, last_snapshot, has_next))
+
+if not records:
+    st.info("該当する診断履歴はありません。")
+else:
+    rows = [
         {
-            "campaign": "キャンペーンA",
-            "banner_name": "バナーA",
-            "platform": "Instagram",
-            "category": "広告",
-            "score": "A",
-            "ad_cost": "",
-            "impressions": "",
-            "clicks": "",
-            "followers": "",
-            "notes": ""
+            "日時": record["created_at"].strftime("%Y-%m-%d %H:%M") if record.get("created_at") else "",
+            "画像": auth_utils.get_signed_image_url(record.get("thumbnail_path") or record.get("image_path"))
+                    or record.get("image_url") or None,
+            "媒体": record.get("platform", ""),
+            "カテゴリ": record.get("category", ""),
+            "業種": record.get("industry", ""),
+            "スコア": record.get("score", ""),
+            "改善コメント": record.get("comment", ""),
+            "薬機法": record.get("yakujihou") or "",
+            "結果": record.get("result", ""),
+            "フォロワー増加": record.get("follower_gain", ""),
+            "メモ": record.get("memo", ""),
         }
+        for record in records
     ]
+    # 画像はWebPサムネイルの署名URL。表示範囲に入った行のものだけブラウザが読み込む
+    st.dataframe(
+        rows,
+        use_container_width=True,
+        hide_index=True,
+        column_config={"画像": st.column_config.ImageColumn("画像", width="small")},
+    )
+
+
+def go_to_page(new_page, cursor=None):
+    if cursor is not None and len(st.session_state.history_cursors) <= new_page:
+        st.session_state.history_cursors.append(cursor)
+    st.session_state.history_page = new_page
 
-# 表として編集できるように
-df = pd.DataFrame(st.session_state["records"])
-edited_df = st.data_editor(df, num_rows="dynamic")
 
-# 上書き保存ボタン（仮実装）
-if st.button("💾 編集内容を保存"):
-    st.session_state["records"] = edited_df.to_dict(orient="records")
-    st.success("保存しました（仮）")
+nav_cols = st.columns([1, 1, 4])
+with nav_cols[0]:
+    st.button("← 前へ", key="history_prev", disabled=page == 0, on_click=go_to_page, args=(page - 1,))
+with nav_cols[1]:
+    st.button("次へ →", key="history_next", disabled=not has_next, on_click=go_to_page, args=(page + 1, last_snapshot))
+with nav_cols[2]:
+    st.caption(f"{page + 1} ページ目")
@@ -0,0 +1,144 @@
+import streamlit as st
+
+import auth_utils  # Firebase 認証/残回数管理
+import clients
+import diagnosis
+import llm_backends
+import theme
+import uploads
+
+# ---------------------------
+# ページ設定 & ログインチェック
+# ---------------------------
+st.set_page_config(layout="wide", page_title="バナスコAI - 一括診断")
+theme.inject_theme()
+auth_utils.check_login()
+
+client = clients.get_openai_client()
+if not llm_backends.is_live(client):
+    st.warning("デモモード - OpenAI APIを使わずに応答を生成しています")
+
+# 1ジョブあたりの最大枚数
+BULK_MAX_FILES = 100
+
+st.title("🗂️ バナー一括診断")
+st.markdown("複数のバナー画像（またはZIP）をまとめてアップロードし、同じ条件で一括採点します。")
+
+# ---------------------------
+# 1) 診断条件
+# ---------------------------
+st.markdown("### 診断条件")
+cond_cols = st.columns(3)
+with cond_cols[0]:
+    age_group = st.selectbox(
+        "ターゲット年代",
+        ["指定なし", "10代", "20代", "30代", "40代", "50代", "60代以上"],
+        key="bulk_age_group"
+    )
+    platform = st.selectbox("媒体", ["Instagram", "GDN", "YDN"], key="bulk_platform")
+with cond_cols[1]:
+    category = st.selectbox("カテゴリ", ["広告", "投稿"] if platform == "Instagram" else ["広告"], key="bulk_category")
+    purpose = st.selectbox(
+        "目的",
+        ["プロフィール誘導", "リンククリック", "保存数増加", "インプレッション増加"],
+        key="bulk_purpose"
+    )
+with cond_cols[2]:
+    industry = st.selectbox("業種", ["美容", "飲食", "不動産", "子ども写真館", "その他"], key="bulk_industry")
+    score_format = st.radio("スコア形式", ["A/B/C", "100点満点"], horizontal=True, key="bulk_score_format")
+
+concurrency = st.slider("同時実行数", 1, diagnosis.BULK_MAX_CONCURRENCY, min(4, diagnosis.BULK_MAX_CONCURRENCY), key="bulk_concurrency")
+memo = st.text_input("メモ（任意・全件共通）", key="bulk_memo")
+
+# ---------------------------
+# 2) 画像アップロード
+# ---------------------------
+uploaded_files = st.file_uploader(
+    f"バナー画像またはZIPをアップロード（最大{BULK_MAX_FILES}枚）",
+    type=["png", "jpg", "jpeg", "zip"],
+    accept_multiple_files=True,
+    key="bulk_upload"
+)
+
+images, skipped = uploads.expand_bulk_uploads(uploaded_files or [], BULK_MAX_FILES)
+if images:
+    st.caption(f"診断対象：{len(images)}枚（1枚につき1回分を消費します）")
+if skipped:
+    st.warning(f"次のファイルは対象外のためスキップします：{', '.join(skipped[:10])}{' ほか' if len(skipped) > 10 else ''}")
+
+# ---------------------------
+# 3) 一括診断の実行
+# ---------------------------
+if st.button("🚀 一括診断を開始", key="bulk_start", disabled=not images):
+    user_plan = st.session_state.get("plan", "Guest")
+    remaining_uses = st.session_state.get("remaining_uses", 0)
+
+    # 残回数はジョブ全体で1回だけチェックする
+    if user_plan in ["Free", "Guest"]:
+        st.warning("この機能はFree/Guestプランではご利用いただけません。Light以上のプランでご利用ください。")
+        st.stop()
+    if remaining_uses < len(images):
+        st.warning(f"残り回数が不足しています。（必要：{len(images)}回 / 残り：{remaining_uses}回）")
+        st.info("枚数を減らすか、プランのアップグレードをご検討ください。")
+        st.stop()
+
+    # 利用回数は枚数分を予約しておき、記録と同じバッチで成功した枚数分だけ減らす。
+    # エラーになった分や、途中で中断された場合の予約は自動で返却される
+    with auth_utils.reserved_uses(st.session_state["user"], len(images)) as reservation:
+        if reservation is None:
+            st.error("利用回数の確保に失敗しました。")
+            st.stop()
+
+        settings = {
+            "platform": platform,
+            "category": category,
+            "industry": industry,
+            "age_group": age_group,
+            "purpose": purpose,
+            "score_format": score_format,
+            "result": "",
+            "follower_gain": "",
+            "memo": memo,
+            "plan": user_plan,
+        }
+
+        rows = [
+            {"No.": index + 1, "ファイル名": image["name"], "スコア": "…", "改善コメント": "", "状態": "待機中", "画像URL": ""}
+            for index, image in enumerate(images)
+        ]
+        records = []
+        progress = st.progress(0.0, text="診断を開始しています...")
+        table_area = st.empty()
+
+        for done, (index, result) in enumerate(
+            diagnosis.iter_diagnoses(client, st.session_state["user"], images, settings, concurrency),
+            start=1
+        ):
+            rows[index].update({
+                "スコア": result["score"] or "エラー",
+                "改善コメント": result["comment"] or "",
+                "状態": "エラー" if result["error"] else ("キャッシュ" if result["cached"] else "完了"),
+                "画像URL": result["image_url"] or "",
+            })
+            if result["error"]:
+                rows[index]["改善コメント"] = result["error"]
+            if result["record"]:
+                result["record"]["banner_name"] = images[index]["name"]
+                records.append(result["record"])
+            progress.progress(done / len(images), text=f"{done} / {len(images)} 枚完了")
+            table_area.dataframe(rows, use_container_width=True, hide_index=True)
+
+        # 利用回数の減算とFirestoreへの記録をまとめて書き込む
+        if auth_utils.commit_uses_in_firestore(reservation, len(records), records) and records:
+            st.success(f"{len(records)}件の診断結果をFirestoreに記録しました！")
+
+    st.session_state["bulk_results"] = rows
+    table_area.empty()
+    progress.empty()
+
+# ---------------------------
+# 4) 結果表示（列見出しクリックで並べ替え可能）
+# ---------------------------
+if st.session_state.get("bulk_results"):
+    st.markdown("### 📊 診断結果")
+    st.dataframe(st.session_state["bulk_results"], use_container_width=True, hide_index=True)
@@ -1,7 +1,8 @@
-import requests
 import streamlit as st
 from datetime import datetime
 
+import gas_outbox
+
 # ✅ 最新のGAS URLをここに貼ってください
 GAS_URL = "https://script.google.com/macros/s/AKfycbzQadO4iuzhETiiDZb2ZQ7et_Rgjb_kR7OIUyL0mK2wqU2-FB2UeN4FVtdyK3Xod3Tm/exec"
 
@@ -15,20 +16,10 @@ data = {
 
 st.write("🖋 送信データ:", data)
 
+# GASへの送信はキューに積むだけ（応答は待たず、バックグラウンドで送られる）
 try:
-    response = requests.post(
-        GAS_URL,
-        json=data,
-        headers={"Content-Type": "application/json"}
-    )
-
-    st.write("📡 GAS応答ステータスコード:", response.status_code)
-    st.write("📄 GAS応答本文:", response.text)
-
-    if response.status_code == 200:
-        st.success("📊 スプレッドシートに記録されました！")
-    else:
-        st.error("❌ GAS送信エラー：ステータスコード200ではありません")
-
+    gas_outbox.enqueue(GAS_URL, data)
+    st.success("📊 スプレッドシートへの記録をキューに追加しました！")
+    st.write("📮 送信待ち件数:", gas_outbox.get_outbox().pending_count())
 except Exception as e:
-    st.error(f"❌ リクエスト送信中にエラー: {e}")
+    st.error(f"❌ 送信キューへの追加中にエラー: {e}")
@@ -1,10 +1,16 @@
 import streamlit as st
 import os
+import time
 from PIL import Image
-from openai import OpenAI
 from datetime import datetime
 
 import auth_utils  # Firebase 認証/残回数管理
+import clients
+import llm_backends
+import llm_scheduler
+import prompts
+import theme
+import yakujihou
 
 # ---------------------------
 # ページ設定 & ログインチェック
@@ -12,430 +18,13 @@ import auth_utils  # Firebase 認証/残回数管理
 st.set_page_config(layout="wide", page_title="バナスコAI - コピー生成")
 auth_utils.check_login()
 
-# OpenAI 初期化
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    st.error("❌ OpenAI APIキーが見つかりませんでした。`.env` を確認してください。")
-    st.stop()
-client = OpenAI(api_key=openai_api_key)
+# OpenAI 初期化（プロセス共有のクライアント）
+client = clients.get_openai_client()
+if not llm_backends.is_live(client):
+    st.warning("デモモード - OpenAI APIを使わずに応答を生成しています")
 
 # --- Ultimate Professional CSS Theme ---
-st.markdown(
-    """
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800;900&family=JetBrains+Mono:wght@300;400;500;600;700&display=swap');
-    
-    /* Professional dark gradient background */
-    .stApp {
-        background: linear-gradient(135deg, #0f0f1a 0%, #1a1c29 15%, #2d3748 35%, #1a202c 50%, #2d3748 65%, #4a5568 85%, #2d3748 100%) !important;
-        background-attachment: fixed;
-        background-size: 400% 400%;
-        animation: background-flow 15s ease-in-out infinite;
-    }
-    
-    @keyframes background-flow {
-        0%, 100% { background-position: 0% 50%; }
-        50% { background-position: 100% 50%; }
-    }
-    
-    body {
-        background: transparent !important;
-        font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif !important;
-    }
-
-    /* Professional main container with glassmorphism */
-    .main .block-container {
-        background: rgba(26, 32, 44, 0.4) !important;
-        backdrop-filter: blur(60px) !important;
-        border: 2px solid rgba(255, 255, 255, 0.1) !important;
-        border-radius: 32px !important;
-        box-shadow: 
-            0 50px 100px -20px rgba(0, 0, 0, 0.6),
-            0 0 0 1px rgba(255, 255, 255, 0.05),
-            inset 0 2px 0 rgba(255, 255, 255, 0.15) !important;
-        padding: 5rem 4rem !important;
-        position: relative !important;
-        margin: 2rem auto !important;
-        max-width: 1400px !important;
-        min-height: 95vh !important;
-    }
-    
-    .main .block-container::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: 0;
-        right: 0;
-        bottom: 0;
-        background: linear-gradient(135deg, 
-            rgba(56, 189, 248, 0.04) 0%, 
-            rgba(147, 51, 234, 0.04) 25%, 
-            rgba(59, 130, 246, 0.04) 50%, 
-            rgba(168, 85, 247, 0.04) 75%, 
-            rgba(56, 189, 248, 0.04) 100%);
-        border-radius: 32px;
-        pointer-events: none;
-        z-index: -1;
-        animation: container-glow 8s ease-in-out infinite alternate;
-    }
-    
-    @keyframes container-glow {
-        from { opacity: 0.3; }
-        to { opacity: 0.7; }
-    }
-
-    /* Professional sidebar */
-    .stSidebar {
-        background: linear-gradient(180deg, rgba(15, 15, 26, 0.98) 0%, rgba(26, 32, 44, 0.98) 100%) !important;
-        backdrop-filter: blur(40px) !important;
-        border-right: 2px solid rgba(255, 255, 255, 0.1) !important;
-        box-shadow: 8px 0 50px rgba(0, 0, 0, 0.5) !important;
-    }
-    
-    .stSidebar > div:first-child {
-        background: transparent !important;
-    }
-    
-    /* Ultimate gradient button styling */
-    .stButton > button {
-        background: linear-gradient(135deg, #38bdf8 0%, #a855f7 50%, #06d6a0 100%) !important;
-        color: #ffffff !important;
-        border: none !important;
-        border-radius: 60px !important;
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 700 !important;
-        font-size: 1.1rem !important;
-        padding: 1.25rem 3rem !important;
-        letter-spacing: 0.05em !important;
-        box-shadow: 
-            0 15px 35px rgba(56, 189, 248, 0.4),
-            0 8px 20px rgba(168, 85, 247, 0.3),
-            0 0 60px rgba(6, 214, 160, 0.2),
-            inset 0 2px 0 rgba(255, 255, 255, 0.3) !important;
-        transition: all 0.5s cubic-bezier(0.4, 0, 0.2, 1) !important;
-        position: relative !important;
-        overflow: hidden !important;
-        backdrop-filter: blur(20px) !important;
-        width: 100% !important;
-        text-transform: uppercase !important;
-        transform: perspective(1000px) translateZ(0);
-    }
-    
-    .stButton > button::before {
-        content: '';
-        position: absolute;
-        top: 0;
-        left: -100%;
-        width: 100%;
-        height: 100%;
-        background: linear-gradient(90deg, transparent, rgba(255, 255, 255, 0.4), transparent);
-        transition: left 0.8s;
-        z-index: 1;
-    }
-    
-    .stButton > button:hover {
-        background: linear-gradient(135deg, #0ea5e9 0%, #9333ea 50%, #059669 100%) !important;
-        box-shadow: 
-            0 25px 50px rgba(56, 189, 248, 0.6),
-            0 15px 35px rgba(168, 85, 247, 0.5),
-            0 0 100px rgba(6, 214, 160, 0.4),
-            inset 0 2px 0 rgba(255, 255, 255, 0.4) !important;
-        transform: translateY(-5px) scale(1.03) perspective(1000px) translateZ(20px) !important;
-    }
-    
-    .stButton > button:active {
-        transform: translateY(-2px) scale(1.01) !important;
-        box-shadow: 
-            0 15px 30px rgba(56, 189, 248, 0.4),
-            0 8px 20px rgba(168, 85, 247, 0.3) !important;
-    }
-
-    /* Ultimate expander styling */
-    .stExpander {
-        background: rgba(26, 32, 44, 0.6) !important;
-        border: 2px solid rgba(255, 255, 255, 0.15) !important;
-        border-radius: 24px !important;
-        backdrop-filter: blur(40px) !important;
-        margin: 2rem 0 !important;
-        overflow: hidden !important;
-        box-shadow: 
-            0 20px 40px rgba(0, 0, 0, 0.3),
-            0 0 80px rgba(56, 189, 248, 0.1),
-            inset 0 2px 0 rgba(255, 255, 255, 0.15) !important;
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1) !important;
-    }
-    
-    .stExpander:hover {
-        transform: translateY(-4px) scale(1.01) !important;
-        box-shadow: 
-            0 30px 60px rgba(0, 0, 0, 0.4),
-            0 0 120px rgba(56, 189, 248, 0.2),
-            inset 0 2px 0 rgba(255, 255, 255, 0.2) !important;
-        border-color: rgba(56, 189, 248, 0.3) !important;
-    }
-    
-    .stExpander > div > div {
-        background: linear-gradient(135deg, rgba(56, 189, 248, 0.15) 0%, rgba(168, 85, 247, 0.15) 100%) !important;
-        border-bottom: 2px solid rgba(255, 255, 255, 0.15) !important;
-        border-radius: 24px 24px 0 0 !important;
-        color: rgba(255, 255, 255, 0.95) !important;
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 700 !important;
-        letter-spacing: 0.05em !important;
-        padding: 2rem !important;
-        font-size: 1.2rem !important;
-        text-transform: uppercase;
-    }
-    /* Hide the "Collapse" text on the expander */
-    .stExpander > button > div:last-child {
-        display: none;
-    }
-    
-    .stExpanderDetails {
-        background: rgba(26, 32, 44, 0.4) !important;
-        border-radius: 0 0 24px 24px !important;
-        padding: 2.5rem !important;
-    }
-
-    /* Ultimate input styling - MODIFIED */
-    div[data-baseweb="input"] input,
-    div[data-baseweb="select"] span,
-    div[data-baseweb="textarea"] textarea,
-    .stSelectbox .st-bv,
-    .stTextInput .st-eb,
-    .stTextArea .st-eb,
-    /* --- More robust selectors for text color --- */
-    [data-testid="stTextInput"] input,
-    [data-testid="stSelectbox"] span,
-    [data-testid="stTextarea"] textarea {
-        background: rgba(26, 32, 44, 0.8) !important;
-        color: #FBC02D !important; /* CHANGED TO YELLOW */
-        border: 2px solid rgba(255, 255, 255, 0.2) !important;
-        border-radius: 16px !important;
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 500 !important;
-        backdrop-filter: blur(40px) !important;
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1) !important;
-        box-shadow: 
-            0 8px 16px rgba(0, 0, 0, 0.2),
-            0 0 40px rgba(56, 189, 248, 0.1),
-            inset 0 2px 0 rgba(255, 255, 255, 0.15) !important;
-        padding: 1rem 1.5rem !important;
-        font-size: 1rem !important;
-    }
-    
-    /* Advanced focus effect */
-    div[data-baseweb="input"] input:focus,
-    div[data-baseweb="select"] span:focus,
-    div[data-baseweb="textarea"] textarea:focus,
-    div[data-baseweb="input"]:focus-within,
-    div[data-baseweb="select"]:focus-within,
-    div[data-baseweb="textarea"]:focus-within {
-        border-color: rgba(56, 189, 248, 0.8) !important;
-        box-shadow: 
-            0 0 0 4px rgba(56, 189, 248, 0.3),
-            0 15px 35px rgba(56, 189, 248, 0.2),
-            0 0 80px rgba(56, 189, 248, 0.15),
-            inset 0 2px 0 rgba(255, 255, 255, 0.25) !important;
-        transform: translateY(-2px) scale(1.01) !important;
-        background: rgba(26, 32, 44, 0.9) !important;
-    }
-
-    /* Ultimate title styling */
-    h1, .stTitle {
-        font-size: 5rem !important;
-        font-weight: 900 !important;
-        background: linear-gradient(135deg, #38bdf8 0%, #a855f7 20%, #3b82f6 40%, #06d6a0 60%, #f59e0b 80%, #38bdf8 100%) !important;
-        background-size: 600% 600% !important;
-        -webkit-background-clip: text !important;
-        -webkit-text-fill-color: transparent !important;
-        background-clip: text !important;
-        text-align: center !important;
-        margin: 2rem 0 !important;
-        letter-spacing: -0.05em !important;
-        animation: mega-gradient-shift 12s ease-in-out infinite !important;
-        text-shadow: 0 0 80px rgba(56, 189, 248, 0.5) !important;
-        transform: perspective(1000px) rotateX(10deg);
-    }
-    
-    @keyframes mega-gradient-shift {
-        0%, 100% { background-position: 0% 50%; }
-        20% { background-position: 100% 0%; }
-        40% { background-position: 100% 100%; }
-        60% { background-position: 50% 100%; }
-        80% { background-position: 0% 100%; }
-    }
-    
-    h2, .stSubheader {
-        color: #ffffff !important;
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 600 !important;
-        font-size: 1.6rem !important;
-        text-align: center !important;
-        margin-bottom: 3rem !important;
-        letter-spacing: 0.05em !important;
-    }
-    
-    h3, h4, h5, h6 {
-        color: #ffffff !important;
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 700 !important;
-        letter-spacing: 0.025em !important;
-    }
-
-    /* Professional text styling */
-    p, div, span, label, .stMarkdown {
-        color: #ffffff !important;
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 400 !important;
-        line-height: 1.7 !important;
-    }
-    
-    /* Ultimate file uploader styling */
-    .stFileUploader {
-        border: 3px dashed rgba(56, 189, 248, 0.7) !important;
-        border-radius: 24px !important;
-        background: rgba(26, 32, 44, 0.4) !important;
-        backdrop-filter: blur(20px) !important;
-        box-shadow: 
-            0 15px 35px rgba(0, 0, 0, 0.25),
-            0 0 60px rgba(56, 189, 248, 0.2),
-            inset 0 2px 0 rgba(255, 255, 255, 0.15) !important;
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1) !important;
-        padding: 3rem !important;
-    }
-    
-    .stFileUploader:hover {
-        border-color: rgba(168, 85, 247, 0.9) !important;
-        background: rgba(26, 32, 44, 0.6) !important;
-        box-shadow: 
-            0 25px 50px rgba(0, 0, 0, 0.3),
-            0 0 100px rgba(168, 85, 247, 0.4),
-            inset 0 2px 0 rgba(255, 255, 255, 0.2) !important;
-        transform: translateY(-4px) scale(1.02) !important;
-    }
-
-    /* Ultimate image styling */
-    .stImage > img {
-        border: 3px solid rgba(56, 189, 248, 0.4) !important;
-        border-radius: 20px !important;
-        box-shadow: 
-            0 20px 40px rgba(0, 0, 0, 0.3),
-            0 0 60px rgba(56, 189, 248, 0.3) !important;
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1) !important;
-    }
-    
-    .stImage > img:hover {
-        transform: scale(1.03) translateY(-4px) !important;
-        box-shadow: 
-            0 30px 60px rgba(0, 0, 0, 0.4),
-            0 0 100px rgba(56, 189, 248, 0.5) !important;
-        border-color: rgba(168, 85, 247, 0.6) !important;
-    }
-    
-    /* Remove Streamlit branding */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    
-    /* Ultimate scrollbar */
-    ::-webkit-scrollbar { width: 12px; }
-    ::-webkit-scrollbar-track { background: rgba(26, 32, 44, 0.4); border-radius: 6px; }
-    ::-webkit-scrollbar-thumb { background: linear-gradient(135deg, #38bdf8, #a855f7); border-radius: 6px; box-shadow: 0 0 20px rgba(56, 189, 248, 0.5); }
-    ::-webkit-scrollbar-thumb:hover { background: linear-gradient(135deg, #0ea5e9, #9333ea); box-shadow: 0 0 30px rgba(168, 85, 247, 0.7); }
-    
-    /* === 入力欄の文字色を黄色に（値・キャレット・プレースホルダー） === */
-    .stTextInput input,
-    .stTextArea textarea,
-    div[data-baseweb="input"] input {
-      color: #FBC02D !important;
-      caret-color: #FBC02D !important;
-    }
-    .stTextInput input::placeholder,
-    .stTextArea textarea::placeholder,
-    div[data-baseweb="input"] input::placeholder {
-      color: rgba(251, 192, 45, 0.6) !important;
-    }
-    .stTextInput input:disabled,
-    .stTextArea textarea:disabled,
-    div[data-baseweb="input"] input:disabled {
-      color: rgba(251, 192, 45, 0.5) !important;
-    }
-    
-    /* === セレクトの表示値（閉じている時のテキスト）を黄色に === */
-    div[data-baseweb="select"] span,
-    div[data-baseweb="select"] div[role="button"] {
-      color: #FBC02D !important;
-    }
-    
-    /* ▼アイコンも黄色に */
-    div[data-baseweb="select"] svg {
-      color: #FBC02D !important;
-      fill: #FBC02D !important;
-      opacity: 0.95 !important;
-    }
-    
-    /* === セレクトのドロップダウン（ポップオーバー）は body 直下に出るのでグローバル指定 === */
-    /* 背景をダーク、文字を白にして可読性を確保 */
-    [data-baseweb="popover"],
-    [role="listbox"],
-    [data-baseweb="menu"] {
-      background: #11131e !important;
-      border: 2px solid rgba(255, 255, 255, 0.2) !important;
-      border-radius: 20px !important;
-      box-shadow: 0 30px 60px rgba(0,0,0,0.4) !important;
-      z-index: 9999 !important;
-    }
-    [data-baseweb="popover"] ul li,
-    [role="option"],
-    [data-baseweb="menu"] li {
-      color: #ffffff !important;
-    }
-    [role="option"][aria-selected="true"],
-    [data-baseweb="menu"] li[aria-selected="true"],
-    [data-baseweb="menu"] li:hover {
-      background: linear-gradient(135deg, rgba(56,189,248,0.3), rgba(168,85,247,0.3)) !important;
-      color: #ffffff !important;
-    }
-
-    /* ① セレクトの「プレート」（閉じている時の白い板）を黒に */
-    [data-testid="stSelectbox"] > div > div {
-      background: #0b0d15 !important;              /* 黒 */
-      border: 2px solid rgba(255,255,255,0.2) !important;
-      border-radius: 16px !important;
-    }
-
-    /* ② ドロップダウンのパネル自体（開いた時の白い板）を黒に */
-    body > div[role="listbox"],
-    body > div[data-baseweb="popover"] {
-      background: #0b0d15 !important;              /* 黒 */
-      border: 2px solid rgba(255,255,255,0.2) !important;
-      border-radius: 20px !important;
-      box-shadow: 0 30px 60px rgba(0,0,0,0.4) !important;
-      z-index: 9999 !important;
-    }
-
-    /* ③ パネル内の要素で白背景が残る場合の保険（透明化） */
-    body > div[role="listbox"] * ,
-    body > div[data-baseweb="popover"] * {
-      background-color: transparent !important;
-    }
-
-    /* ④ 選択肢のホバー／選択時 */
-    body [role="option"] { color: #ffffff !important; }
-    body [role="option"][aria-selected="true"],
-    body [role="option"]:hover {
-      background: rgba(56,189,248,0.18) !important;
-    }
-
-    /* ⑤ セレクトの値（閉じている時の表示行）も黒背景で統一 */
-    div[data-baseweb="select"] > div[role="combobox"] {
-      background: #0b0d15 !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+theme.inject_theme()  # 全ページ共通テーマ（static/theme.css）
 
 st.title("📸 バナー画像からコピー案を生成")
 
@@ -531,6 +120,7 @@ if enable_caption:
 needs_yakkihou = category in ["脱毛サロン", "エステ", "ホワイトニング"]
 
 def build_prompt():
+    """入力内容からコピー生成の messages を作る。何も選ばれていなければNone"""
     # コピータイプの指示をまとめる
     type_instructions = []
     if want_main:
@@ -544,61 +134,52 @@ def build_prompt():
     if not type_instructions and not enable_caption:
         return None  # 何も選ばれていない
 
-    emoji_rule = "・各案に1〜2個の絵文字を自然に入れてください。" if include_emoji else "・絵文字は使用しないでください。"
-    urgency_rule = "・必要に応じて『期間限定』『先着順』『残りわずか』などの緊急性フレーズも自然に織り交ぜてください。" if include_urgency else ""
-    yakki_rule = "・薬機法/医療広告ガイドラインに抵触する表現は避けてください（例：治る、即効、永久、医療行為の示唆 など）。" if needs_yakkihou else ""
-    cap_rule = ""
+    rules = [
+        "・各案に1〜2個の絵文字を自然に入れてください。" if include_emoji else "・絵文字は使用しないでください。",
+    ]
+    if include_urgency:
+        rules.append("・必要に応じて『期間限定』『先着順』『残りわずか』などの緊急性フレーズも自然に織り交ぜてください。")
+    if needs_yakkihou:
+        rules.append("・薬機法/医療広告ガイドラインに抵触する表現は避けてください（例：治る、即効、永久、医療行為の示唆 など）。")
+    caption = ""
     if enable_caption and caption_lines > 0:
-        cap_rule = f"""
-### 投稿文作成
-- 改行で{caption_lines}行の投稿文を作成（行ごとに要点を変えてください）
-- 1行あたり読みやすい長さ（40〜60文字目安）
-- ターゲットとトーンに合わせて自然な日本語
-- ハッシュタグは付けない
-- 任意ワードがあれば必ず自然に含める（過剰な羅列は禁止）
-"""
-
-    keywords_text = f"任意ワード：{caption_keywords}" if caption_keywords else "任意ワード：なし"
-
-    # 最終プロンプト
-    return f"""
-あなたは優秀な広告コピーライターです。下記条件に沿って、用途別に日本語で提案してください。出力は**Markdown**で、各セクションに見出しを付け、番号付きリストで返してください。
-
-【業種】{category}
-【ターゲット層】{target or '未指定'}
-【特徴・アピールポイント】{feature or '未指定'}
-【トーン】{tone}
-【{keywords_text}】
-【共通ルール】
-- 同じ方向性を避け、毎案ニュアンスを変える
-- 媒体に載せやすい簡潔な文
-- 露骨な煽りは避けつつ、訴求は明確に
-{emoji_rule}
-{urgency_rule}
-{yakki_rule}
-
-### 生成対象
-{os.linesep.join(type_instructions) if type_instructions else '- （コピータイプなし）'}
-
-{cap_rule}
-
-### 追加ガイド
-- **キャッチコピー**：インパクト重視/30字以内目安
-- **メインコピー**：価値が伝わる説明的コピー/40字前後
-- **サブコピー**：補足やベネフィット/60字以内
-- **CTAコピー**：行動喚起/16字以内/明快
-
-出力フォーマット例：
-## キャッチコピー
-1. 〜
-2. 〜
-
-## メインコピー
-1. 〜
-...
-
-{ '## 投稿文\n1)\n2)\n...' if enable_caption else '' }
-"""
+        caption = f"\n### 投稿文作成\n- 改行で{caption_lines}行の投稿文を作成"
+
+    # 共通ルール・ガイドは prompts.COPY の system 側。ここでは条件だけを差し込む
+    return prompts.COPY.messages(
+        category=category,
+        target=target or "未指定",
+        feature=feature or "未指定",
+        tone=tone,
+        keywords=caption_keywords or "なし",
+        rules="\n".join(rules),
+        targets=os.linesep.join(type_instructions) if type_instructions else "- （コピータイプなし）",
+        caption=caption,
+    )
+
+# ストリーミング表示の再描画間隔（秒）。トークンごとに再描画すると通信量が増えるため間引く
+STREAM_RENDER_INTERVAL = 0.15
+
+def render_stream(stream, placeholder):
+    """ストリーミング応答を受け取りながらMarkdownとして順次描画し、全文を返す"""
+    output = ""
+    last_render = 0.0
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        output += delta
+        now = time.monotonic()
+        if now - last_render >= STREAM_RENDER_INTERVAL:
+            placeholder.markdown(output + "▌")
+            last_render = now
+    output = output.strip()
+    if not output:
+        raise RuntimeError("AIから応答が返りませんでした。")
+    placeholder.markdown(output)
+    return output
 
 generate_btn = st.button("🚀 コピーを生成する")
 
@@ -617,42 +198,52 @@ if generate_btn:
         st.warning("コピー生成数が0です。少なくとも1案以上を選択するか、投稿文作成を有効にしてください。")
         st.stop()
 
-    prompt = build_prompt()
-    if prompt is None:
+    messages = build_prompt()
+    if messages is None:
         st.warning("コピータイプが1つも選択されていません。少なくとも1つ選択してください。")
         st.stop()
 
-    with st.spinner("コピー案を生成中..."):
-        try:
-            # OpenAI へ投げる
-            resp = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "あなたは日本語に精通した広告コピーライターです。マーケ基礎と法規を理解し、簡潔で効果的な表現を作ります。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.9,
-            )
-            output = resp.choices[0].message.content.strip()
-
-            # 表示
-            st.subheader("✍️ 生成結果")
-            st.markdown(output)
-
-            if needs_yakkihou:
-                st.subheader("🔍 薬機法メモ")
-                st.info("※ このカテゴリでは『治る／即効／永久／医療行為の示唆』などはNG。効能・効果の断定表現も避けましょう。")
-
-            # 使⽤回数の消費（失敗してもアプリが落ちないよう try）
-            try:
-                if auth_utils.update_user_uses_in_firestore_rest(
-                    st.session_state.get("user"),
-                    st.session_state.get("id_token")
-                ):
-                    # UI上の残回数を1減らす
-                    st.session_state["remaining_uses"] = max(0, remaining_uses - 1)
-            except Exception:
-                pass
-
-        except Exception as e:
-            st.error(f"コピー生成中にエラーが発生しました：{e}")
+    st.subheader("✍️ 生成結果")
+    output_area = st.empty()
+    output_area.caption("コピー案を生成中...")
+    try:
+        # OpenAI へ投げる（トークンが届いた順に表示する）
+        # 混雑時はスケジューラが待機・再試行する。同時実行枠はストリームを読み終えるまで確保される
+        stream = llm_scheduler.get_scheduler().stream_chat_completion(
+            client,
+            uid=st.session_state.get("user"),
+            plan=user_plan,
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.9,
+        )
+        output = render_stream(stream, output_area)
+
+        if needs_yakkihou:
+            st.subheader("🔍 薬機法メモ")
+            st.info("※ このカテゴリでは『治る／即効／永久／医療行為の示唆』などはNG。効能・効果の断定表現も避けましょう。")
+
+        # 生成された各行をローカルのNG表現辞書でチェックし、該当箇所を強調表示する
+        flagged_lines = []
+        for line in output.splitlines():
+            highlighted, matches = yakujihou.highlight_ng_expressions(line.strip())
+            if matches:
+                flagged_lines.append((highlighted, matches))
+        if flagged_lines:
+            st.subheader("⚠️ NG表現の可能性")
+            for highlighted, matches in flagged_lines:
+                st.markdown(f"- {highlighted}")
+                st.caption(yakujihou.format_ng_reasons(matches))
+        elif needs_yakkihou:
+            st.success("NG表現辞書に該当する表現は見つかりませんでした。")
+
+        # 使⽤回数の消費はストリームが最後まで届いた場合のみ（失敗時は auth_utils がエラーを表示する）
+        if auth_utils.update_user_uses_in_firestore_rest(
+            st.session_state.get("user"),
+            auth_utils.get_id_token()
+        ):
+            # UI上の残回数を1減らす
+            st.session_state["remaining_uses"] = max(0, remaining_uses - 1)
+
+    except Exception as e:
+        st.error(f"コピー生成中にエラーが発生しました：{e}")
@@ -0,0 +1,201 @@
+# prompts.py
+"""LLMに送るプロンプトのテンプレート。
+
+どのテンプレートも、変わらない指示・評価基準を system メッセージに、リクエストごとに変わる値を
+user メッセージの後ろに置く。先頭が毎回同じになるので、OpenAI側のプロンプトキャッシュが効く。
+文言を変えたら version を上げる（診断記録の prompt_version と診断キャッシュのキーに使われる）。
+"""
+from string import Template
+
+# --- バナー採点の評価基準 ---
+# キーはJSON出力・Firestore記録で使う
+CRITERIA = [
+    ("clarity", "内容が一瞬で伝わるか"),
+    ("readability", "コピーの見やすさ"),
+    ("call_to_action", "行動喚起"),
+    ("consistency", "写真とテキストの整合性"),
+    ("balance", "情報量のバランス"),
+]
+CRITERION_MIN = 1
+CRITERION_MAX = 5
+
+# 「A/B/C」形式で使うグレード
+GRADES = ["S", "A+", "A", "A-", "B+", "B", "B-", "C+", "C", "C-"]
+
+# 薬機法チェックを採点と同じリクエストで行う場合の判定
+COMPLIANCE_VERDICTS = ["OK", "注意あり"]
+
+
+class PromptTemplate:
+    """静的な system メッセージと、値を差し込む user メッセージの組（user 側は作成時に一度だけコンパイルする）"""
+
+    def __init__(self, name, version, system, user):
+        self.name = name
+        self.version = version
+        self.system = system.strip()
+        self.user = Template(user.strip())
+
+    @property
+    def id(self):
+        """記録用の識別子（例: scoring@2）"""
+        return f"{self.name}@{self.version}"
+
+    def render(self, **values):
+        """user メッセージの本文を作る"""
+        return self.user.substitute(values)
+
+    def messages(self, images=(), **values):
+        """chat.completions に渡す messages を作る。images には image_url パートの辞書を渡す"""
+        text = self.render(**values)
+        content = [{"type": "text", "text": text}, *images] if images else text
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": content},
+        ]
+
+
+_criteria_lines = "\n".join(f"{i}. {label}（{key}）" for i, (key, label) in enumerate(CRITERIA, start=1))
+
+SCORING = PromptTemplate(
+    name="scoring",
+    version="2",
+    system=f"""
+あなたは広告のプロです。ユーザーが送るバナー画像をプロ視点で採点してください。
+
+【評価基準】
+{_criteria_lines}
+
+【評価基準ごとの点数（{CRITERION_MIN}〜{CRITERION_MAX}の整数）】
+- 5: そのまま出稿できる水準。改善点がほとんどない
+- 4: 良いが、細部に改善の余地がある
+- 3: 標準的。目的に対して明確な改善点がある
+- 2: 目的の達成を妨げる問題がある
+- 1: 大きく作り直す必要がある
+
+【総合スコア】
+- スコア形式が「100点満点」の場合、score は0〜100の整数
+- スコア形式が「A/B/C」の場合、score は {' / '.join(GRADES)} のいずれか
+- 評価基準ごとの点数と矛盾しないようにする
+
+【改善コメント】
+- comment は改善コメント（2～3行）
+- ターゲット年代と目的を考慮し、具体的に何をどう直すかを書く
+
+【薬機法チェック】
+薬機法チェックが「あり」の場合だけ、改善コメントとバナー内の表現が薬機法に違反していないかを確認してください。
+- yakujihou.verdict は {' / '.join(COMPLIANCE_VERDICTS)} のいずれか
+- yakujihou.reason は判定理由（違反の可能性がある場合は具体的に）
+
+【出力形式】
+指定されたJSONスキーマに沿って返してください。
+""",
+    user="""
+この広告のターゲット年代は「${age_group}」で、主な目的は「${purpose}」です。
+スコア形式：${score_format}
+薬機法チェック：${compliance}
+
+ターゲット年代「${age_group}」と目的「${purpose}」を考慮した具体的なフィードバックをお願いします。
+""",
+)
+
+YAKUJIHOU = PromptTemplate(
+    name="yakujihou",
+    version="2",
+    system="""
+あなたは広告表現の専門家です。
+ユーザーが送る広告文（改善コメント）が薬機法に違反していないかをチェックしてください。
+※これはバナー画像の内容に対するAIの改善コメントであり、実際の広告文ではありません。
+
+違反の可能性がある場合は、その理由も具体的に教えてください。
+「OK」「注意あり」どちらかで評価を返してください。
+""",
+    user="""
+---
+${comment}
+---
+""",
+)
+
+AB_COMPARE = PromptTemplate(
+    name="ab_compare",
+    version="2",
+    system="""
+あなたは広告のプロであり、A/Bテストのスペシャリストです。
+ユーザーが送るAパターンとBパターンの広告診断結果を比較し、総合的にどちらが優れているか、その理由と具体的な改善点を提案してください。
+
+【出力形式】
+---
+総合評価: Aパターンが優れている / Bパターンが優れている / どちらも改善が必要
+理由: (2〜3行で簡潔に)
+今後の改善提案: (具体的なアクションを1〜2点)
+---
+""",
+    user="""
+---
+Aパターン診断結果:
+スコア: ${score_a}
+改善コメント: ${comment_a}
+薬機法チェック: ${yakujihou_a}
+
+Bパターン診断結果:
+スコア: ${score_b}
+改善コメント: ${comment_b}
+薬機法チェック: ${yakujihou_b}
+---
+""",
+)
+
+COPY = PromptTemplate(
+    name="copy",
+    version="2",
+    system="""
+あなたは日本語に精通した広告コピーライターです。マーケ基礎と法規を理解し、簡潔で効果的な表現を作ります。
+ユーザーが示す条件に沿って、用途別に日本語で提案してください。出力は**Markdown**で、各セクションに見出しを付け、番号付きリストで返してください。
+
+【共通ルール】
+- 同じ方向性を避け、毎案ニュアンスを変える
+- 媒体に載せやすい簡潔な文
+- 露骨な煽りは避けつつ、訴求は明確に
+- 「生成対象」にないセクションは出力しない
+
+### 追加ガイド
+- **キャッチコピー**：インパクト重視/30字以内目安
+- **メインコピー**：価値が伝わる説明的コピー/40字前後
+- **サブコピー**：補足やベネフィット/60字以内
+- **CTAコピー**：行動喚起/16字以内/明快
+
+### 投稿文作成（依頼された場合のみ）
+- 指定された行数の投稿文を作成（行ごとに要点を変えてください）
+- 1行あたり読みやすい長さ（40〜60文字目安）
+- ターゲットとトーンに合わせて自然な日本語
+- ハッシュタグは付けない
+- 任意ワードがあれば必ず自然に含める（過剰な羅列は禁止）
+
+出力フォーマット例：
+## キャッチコピー
+1. 〜
+2. 〜
+
+## メインコピー
+1. 〜
+...
+
+## 投稿文
+1)
+2)
+...
+""",
+    user="""
+【業種】${category}
+【ターゲット層】${target}
+【特徴・アピールポイント】${feature}
+【トーン】${tone}
+【任意ワード：${keywords}】
+【この依頼でのルール】
+${rules}
+
+### 生成対象
+${targets}
+${caption}
+""",
+)
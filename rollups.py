@@ -0,0 +1,122 @@
+# rollups.py
+import hashlib
+import json
+
+from firebase_admin import firestore
+
+# 集計ドキュメントの場所（users/{uid}/stats/diagnoses）
+ROLLUP_COLLECTION = "stats"
+ROLLUP_DOCUMENT = "diagnoses"
+
+# 集計の切り口（記録のフィールド名 → 集計ドキュメントのキー）
+DIMENSIONS = {"platform": "by_platform", "industry": "by_industry", "genre": "by_genre"}
+
+UNSET = "未設定"
+AB_WINNERS = {"A": "a_wins", "B": "b_wins", None: "no_winner"}
+
+
+def score_bucket(score):
+    """スコアを分布のキーにする。100点満点の数値は10点刻み（例: 80点台）、グレードはそのまま"""
+    score = str(score or "").strip()
+    if score.isdigit():
+        return f"{min(int(score), 100) // 10 * 10}点台"
+    return score or UNSET
+
+
+def parse_follower_gain(value):
+    """フォロワー増加数の入力を数値にする。数値でなければNone"""
+    try:
+        return float(str(value).replace(",", "").replace("+", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _add(counter, path, amount=1):
+    *parents, leaf = path
+    for key in parents:
+        counter = counter.setdefault(key, {})
+    counter[leaf] = counter.get(leaf, 0) + amount
+
+
+def _to_increments(counter):
+    return {
+        key: _to_increments(value) if isinstance(value, dict) else firestore.Increment(value)
+        for key, value in counter.items()
+    }
+
+
+def build_rollup_update(records):
+    """診断記録のリストから、集計ドキュメントに merge で書き込む増分を作る"""
+    counter = {}
+    for record in records:
+        bucket = score_bucket(record.get("score"))
+        _add(counter, ["count"])
+        _add(counter, ["scores", bucket])
+        for field, key in DIMENSIONS.items():
+            value = str(record.get(field) or UNSET)
+            _add(counter, [key, value, "count"])
+            _add(counter, [key, value, "scores", bucket])
+        gain = parse_follower_gain(record.get("follower_gain"))
+        if gain is not None:
+            _add(counter, ["follower_gain", "sum"], gain)
+            _add(counter, ["follower_gain", "count"])
+    if not counter:
+        return {}
+    update = _to_increments(counter)
+    update["updated_at"] = firestore.SERVER_TIMESTAMP
+    return update
+
+
+def build_ab_result_update(winner):
+    """A/B比較の結果（"A" / "B" / None）を集計ドキュメントに merge で書き込む増分を作る"""
+    return {
+        "ab_tests": {"count": firestore.Increment(1), AB_WINNERS.get(winner, "no_winner"): firestore.Increment(1)},
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def parse_ab_winner(content):
+    """A/B比較の応答の「総合評価」から勝ったパターンを返す。どちらとも言えなければNone"""
+    for line in (content or "").splitlines():
+        if "総合評価" not in line:
+            continue
+        verdict = line.split(":", 1)[-1].split("：", 1)[-1]
+        if "Aパターンが" in verdict and "Bパターンが" not in verdict:
+            return "A"
+        if "Bパターンが" in verdict and "Aパターンが" not in verdict:
+            return "B"
+        return None
+    return None
+
+
+def ab_pair_key(score_a, comment_a, score_b, comment_b):
+    """採点済みのA/Bの組を識別するキー（同じ組の比較を二重に集計しないために使う）"""
+    pair = json.dumps([score_a, comment_a, score_b, comment_b], ensure_ascii=False)
+    return hashlib.sha256(pair.encode("utf-8")).hexdigest()
+
+
+def record_ab_result_once(recorded_pairs, pair_key, winner, write):
+    """同じ組の結果は1回だけ write(winner) で集計する。書き込めた組は recorded_pairs に加え、Trueを返す"""
+    if pair_key in recorded_pairs:
+        return False
+    if not write(winner):
+        return False
+    recorded_pairs.add(pair_key)
+    return True
+
+
+def summarize_rollup(data):
+    """集計ドキュメントを表示用の値（件数・平均フォロワー増加数・A/B勝率など）にする"""
+    data = data or {}
+    follower_gain = data.get("follower_gain", {})
+    ab_tests = data.get("ab_tests", {})
+    ab_count = ab_tests.get("count", 0)
+    return {
+        "count": data.get("count", 0),
+        "scores": data.get("scores", {}),
+        **{key: data.get(key, {}) for key in DIMENSIONS.values()},
+        "avg_follower_gain": follower_gain["sum"] / follower_gain["count"] if follower_gain.get("count") else None,
+        "ab_count": ab_count,
+        "ab_a_win_rate": ab_tests.get("a_wins", 0) / ab_count if ab_count else None,
+        "ab_b_win_rate": ab_tests.get("b_wins", 0) / ab_count if ab_count else None,
+    }
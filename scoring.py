@@ -0,0 +1,171 @@
+# scoring.py
+import base64
+import json
+
+import llm_scheduler
+import prompts
+
+# --- 採点設定 ---
+SCORING_MODEL = "gpt-4o"
+SCORING_MAX_TOKENS = 600
+
+# 評価基準・グレード・薬機法の判定は prompts で定義する（プロンプトとスキーマで同じものを使う）
+CRITERIA = prompts.CRITERIA
+CRITERION_MIN = prompts.CRITERION_MIN
+CRITERION_MAX = prompts.CRITERION_MAX
+GRADES = prompts.GRADES
+COMPLIANCE_VERDICTS = prompts.COMPLIANCE_VERDICTS
+
+# 診断記録に残すプロンプトのバージョン
+PROMPT_VERSION = prompts.SCORING.id
+
+PARSE_FAILED = "取得できず"
+
+
+def build_scoring_messages(age_group, purpose, score_format, image_url, include_compliance=False):
+    """バナー採点用の messages を作る。静的な指示が先頭、条件と画像が後ろ"""
+    return prompts.SCORING.messages(
+        images=[{"type": "image_url", "image_url": image_url}],
+        age_group=age_group,
+        purpose=purpose,
+        score_format=score_format,
+        compliance="あり" if include_compliance else "なし",
+    )
+
+
+def build_scoring_schema(score_format, include_compliance=False):
+    """採点結果のJSONスキーマ（Structured Outputs用）を作る"""
+    if score_format == "100点満点":
+        score_schema = {"type": "integer", "description": "0〜100の総合スコア"}
+    else:
+        score_schema = {"type": "string", "enum": GRADES, "description": "総合グレード"}
+    properties = {
+        "score": score_schema,
+        "criteria": {
+            "type": "object",
+            "properties": {
+                key: {"type": "integer", "description": f"{label}（{CRITERION_MIN}〜{CRITERION_MAX}）"}
+                for key, label in CRITERIA
+            },
+            "required": [key for key, _ in CRITERIA],
+            "additionalProperties": False,
+        },
+        "comment": {"type": "string", "description": "改善コメント（2～3行）"},
+    }
+    if include_compliance:
+        properties["yakujihou"] = {
+            "type": "object",
+            "properties": {
+                "verdict": {"type": "string", "enum": COMPLIANCE_VERDICTS},
+                "reason": {"type": "string"},
+            },
+            "required": ["verdict", "reason"],
+            "additionalProperties": False,
+        }
+    return {
+        "name": "banner_score",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        },
+    }
+
+
+def usage_from_response(response):
+    """応答のトークン使用量を辞書にする"""
+    usage = getattr(response, "usage", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+def request_scoring_with_usage(client, image_bytes, age_group, purpose, score_format,
+                               mime_type="image/png", detail=None, include_compliance=False, uid=None, plan=None):
+    """バナー画像をAIに採点させ、(応答テキスト（JSON）, トークン使用量) を返す"""
+    img_str = base64.b64encode(image_bytes).decode()
+    image_url = {"url": f"data:{mime_type};base64,{img_str}"}
+    if detail:
+        image_url["detail"] = detail
+    response = llm_scheduler.get_scheduler().create_chat_completion(
+        client,
+        uid=uid,
+        plan=plan,
+        model=SCORING_MODEL,
+        messages=build_scoring_messages(age_group, purpose, score_format, image_url, include_compliance),
+        max_tokens=SCORING_MAX_TOKENS,
+        response_format={"type": "json_schema", "json_schema": build_scoring_schema(score_format, include_compliance)},
+    )
+    return response.choices[0].message.content, usage_from_response(response)
+
+
+def request_scoring(client, image_bytes, age_group, purpose, score_format,
+                    mime_type="image/png", detail=None, include_compliance=False, uid=None, plan=None):
+    """バナー画像をAIに採点させ、応答テキスト（JSON）を返す"""
+    content, _ = request_scoring_with_usage(
+        client, image_bytes, age_group, purpose, score_format,
+        mime_type=mime_type, detail=detail, include_compliance=include_compliance, uid=uid, plan=plan,
+    )
+    return content
+
+
+def _validate_score(score):
+    if isinstance(score, bool):
+        return PARSE_FAILED
+    if isinstance(score, (int, float)):
+        return str(int(score)) if 0 <= score <= 100 else PARSE_FAILED
+    if isinstance(score, str) and score.strip():
+        return score.strip()
+    return PARSE_FAILED
+
+
+def _validate_criteria(criteria):
+    if not isinstance(criteria, dict):
+        return None
+    validated = {}
+    for key, _ in CRITERIA:
+        value = criteria.get(key)
+        if isinstance(value, bool) or not isinstance(value, int) or not CRITERION_MIN <= value <= CRITERION_MAX:
+            return None
+        validated[key] = value
+    return validated
+
+
+def parse_scoring_response(content):
+    """JSON応答からスコア・改善コメント・観点別スコアを取り出す（スキーマに沿って検証する）。
+
+    JSONでない応答（拒否応答など）や取り出せない項目は「取得できず」、観点別スコアはNoneになる。
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        return PARSE_FAILED, PARSE_FAILED, None
+
+    comment = data.get("comment")
+    comment = comment.strip() if isinstance(comment, str) and comment.strip() else PARSE_FAILED
+    return _validate_score(data.get("score")), comment, _validate_criteria(data.get("criteria"))
+
+
+def parse_compliance_result(content):
+    """応答に含まれる薬機法チェックの結果を「判定 - 理由」の文字列で返す。含まれない・不正な場合はNone"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    compliance = data.get("yakujihou") if isinstance(data, dict) else None
+    if not isinstance(compliance, dict) or compliance.get("verdict") not in COMPLIANCE_VERDICTS:
+        return None
+    reason = compliance.get("reason")
+    if isinstance(reason, str) and reason.strip():
+        return f"{compliance['verdict']} - {reason.strip()}"
+    return compliance["verdict"]
+
+
+def format_criteria(criteria):
+    """観点別スコアを表示用の文字列にする"""
+    return " / ".join(f"{label}: {criteria[key]}" for key, label in CRITERIA if key in criteria)
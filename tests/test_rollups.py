@@ -0,0 +1,60 @@
+import rollups
+
+
+class FakeRollupRef:
+    """集計ドキュメントへの set(..., merge=True) を記録するだけの参照"""
+
+    def __init__(self):
+        self.writes = []
+
+    def set(self, data, merge=False):
+        self.writes.append((data, merge))
+
+
+def compare(recorded_pairs, ref, result_a, result_b, content):
+    # streamlit_app.py のA/B比較と同じ手順で集計する
+    def write(winner):
+        ref.set(rollups.build_ab_result_update(winner), merge=True)
+        return True
+
+    return rollups.record_ab_result_once(
+        recorded_pairs,
+        rollups.ab_pair_key(result_a["score"], result_a["comment"], result_b["score"], result_b["comment"]),
+        rollups.parse_ab_winner(content),
+        write,
+    )
+
+
+def test_compare_twice_on_same_pair_writes_rollup_once():
+    recorded_pairs = set()
+    ref = FakeRollupRef()
+    result_a = {"score": "A", "comment": "文字が多い"}
+    result_b = {"score": "S", "comment": "訴求が明確"}
+
+    assert compare(recorded_pairs, ref, result_a, result_b, "総合評価: Bパターンが優れている")
+    assert not compare(recorded_pairs, ref, result_a, result_b, "総合評価: Aパターンが優れている")
+
+    assert len(ref.writes) == 1
+    data, merge = ref.writes[0]
+    assert merge
+    assert set(data["ab_tests"]) == {"count", "b_wins"}
+
+
+def test_new_pair_is_recorded_again():
+    recorded_pairs = set()
+    ref = FakeRollupRef()
+    result_a = {"score": "A", "comment": "文字が多い"}
+
+    compare(recorded_pairs, ref, result_a, {"score": "S", "comment": "訴求が明確"}, "総合評価: Bパターンが優れている")
+    compare(recorded_pairs, ref, result_a, {"score": "B", "comment": "CTAが弱い"}, "総合評価: Aパターンが優れている")
+
+    assert len(ref.writes) == 2
+
+
+def test_failed_write_is_retried_on_next_compare():
+    recorded_pairs = set()
+    key = rollups.ab_pair_key("A", "a", "B", "b")
+
+    assert not rollups.record_ab_result_once(recorded_pairs, key, "A", lambda winner: False)
+    assert rollups.record_ab_result_once(recorded_pairs, key, "A", lambda winner: True)
+    assert recorded_pairs == {key}
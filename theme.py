@@ -0,0 +1,54 @@
+# theme.py
+import io
+from pathlib import Path
+
+import streamlit as st
+from PIL import Image
+
+BASE_DIR = Path(__file__).parent
+THEME_CSS_PATH = BASE_DIR / "static" / "theme.css"
+LOGO_PATH = BASE_DIR / "banasuko_logo_icon.png"
+
+# サイドバー幅（約300px）の高解像度ディスプレイ向けに十分なサイズ
+LOGO_THUMBNAIL_SIZE = 512
+
+
+@st.cache_resource
+def load_theme_css():
+    """テーマCSSを読み込む（プロセス内で1回だけ）"""
+    return THEME_CSS_PATH.read_text(encoding="utf-8")
+
+
+@st.cache_resource
+def get_logo_thumbnail():
+    """ロゴを縮小したPNGバイト列を返す（プロセス内で1回だけ生成）。ファイルがなければNone"""
+    try:
+        logo = Image.open(LOGO_PATH)
+    except FileNotFoundError:
+        return None
+    logo.thumbnail((LOGO_THUMBNAIL_SIZE, LOGO_THUMBNAIL_SIZE), Image.LANCZOS)
+    output = io.BytesIO()
+    logo.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def inject_theme():
+    """全ページ共通のテーマCSSを適用する。
+
+    Streamlitは再実行ごとに描画されなかった要素を消すため、CSSも毎回出力する必要がある。
+    静的ファイル配信が有効ならブラウザにキャッシュされるCSSファイルを@importで読み込み、
+    再実行ごとに送るのは1行だけにする。無効な場合はCSS本体をインラインで出力する。
+    """
+    if st.get_option("server.enableStaticServing"):
+        st.markdown('<style>@import url("app/static/theme.css");</style>', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>\n{load_theme_css()}\n</style>", unsafe_allow_html=True)
+
+
+def show_sidebar_logo():
+    """サイドバーにロゴ（縮小済み）を表示する"""
+    logo = get_logo_thumbnail()
+    if logo is None:
+        st.sidebar.error(f"ロゴ画像 '{LOGO_PATH.name}' が見つかりません。ファイルが正しく配置されているか確認してください。")
+        return
+    st.sidebar.image(logo, use_container_width=True)
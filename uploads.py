@@ -0,0 +1,113 @@
+# uploads.py
+import io
+import zipfile
+from pathlib import PurePosixPath
+
+import streamlit as st
+from PIL import Image
+
+# セッションごとに保持するアップロード画像の上限（メモリ使用量を抑える）
+MAX_CACHED_UPLOADS = 8
+
+# 一括診断でZIPから取り出す画像の拡張子と1ファイルあたりの上限サイズ
+BULK_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+BULK_MAX_FILE_BYTES = 20 * 1024 * 1024
+
+# 元のバイト列のままStorageに保存できる形式
+PASSTHROUGH_FORMATS = {"PNG": ("image/png", "png"), "JPEG": ("image/jpeg", "jpg")}
+
+
+def open_image_bytes(data, name=None):
+    """画像のバイト列のヘッダーを読み、元データと形式・サイズをまとめた辞書を返す。
+
+    セッションにキャッシュされるので、PIL画像（展開した画素）は持たない。
+    画素が必要な処理はその都度バイト列から開く（image_preprocess.prepare_vision_image など）。
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image_format = image.format
+        size = image.size
+    mime_type, extension = PASSTHROUGH_FORMATS.get(image_format, (None, None))
+    return {
+        "name": name,
+        "data": data,
+        "format": image_format,
+        "size": size,
+        "mime_type": mime_type,
+        "extension": extension,
+    }
+
+
+def _upload_id(uploaded_file):
+    return getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+
+
+def load_uploaded_image(uploaded_file):
+    """st.file_uploader のファイルを開く。同じファイルはセッション内でキャッシュを使い回す"""
+    cache = st.session_state.setdefault("uploaded_images", {})
+    file_id = _upload_id(uploaded_file)
+
+    entry = cache.pop(file_id, None)
+    if entry is None:
+        entry = open_image_bytes(uploaded_file.getvalue(), uploaded_file.name)
+    # 最近使ったものを末尾に置き、古いものから捨てる
+    cache[file_id] = entry
+    while len(cache) > MAX_CACHED_UPLOADS:
+        cache.pop(next(iter(cache)))
+    return entry
+
+
+def storage_payload(entry):
+    """Storageに保存するバイト列・Content-Type・拡張子を返す。PNG/JPEGは元データをそのまま使う"""
+    if entry["mime_type"]:
+        return entry["data"], entry["mime_type"], entry["extension"]
+    output = io.BytesIO()
+    with Image.open(io.BytesIO(entry["data"])) as image:
+        image.save(output, format="PNG")
+    return output.getvalue(), "image/png", "png"
+
+
+def expand_bulk_uploads(uploaded_files, max_files):
+    """一括診断用に、画像ファイルとZIP内の画像を展開して (画像リスト, スキップしたファイル名リスト) を返す。
+    アップロード内容が変わらない間は、再実行のたびに読み直さずセッション内の展開結果を使う"""
+    key = (tuple(_upload_id(uploaded_file) for uploaded_file in uploaded_files), max_files)
+    cached = st.session_state.get("bulk_uploads")
+    if cached is None or cached["key"] != key:
+        # 直近のアップロード分だけを持つ（古い展開結果はメモリに残さない）
+        images, skipped = _expand_bulk_uploads(uploaded_files, max_files)
+        cached = st.session_state["bulk_uploads"] = {"key": key, "images": images, "skipped": skipped}
+    return cached["images"], cached["skipped"]
+
+
+def _expand_bulk_uploads(uploaded_files, max_files):
+    images = []
+    skipped = []
+
+    def add(name, data):
+        if len(images) >= max_files:
+            skipped.append(name)
+            return
+        if len(data) > BULK_MAX_FILE_BYTES:
+            skipped.append(name)
+            return
+        try:
+            images.append(open_image_bytes(data, name))
+        except Exception:
+            skipped.append(name)
+
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            try:
+                with zipfile.ZipFile(io.BytesIO(uploaded_file.getvalue())) as archive:
+                    for info in archive.infolist():
+                        path = PurePosixPath(info.filename)
+                        if info.is_dir() or "__MACOSX" in path.parts or path.name.startswith("."):
+                            continue
+                        if path.suffix.lower() not in BULK_IMAGE_EXTENSIONS or info.file_size > BULK_MAX_FILE_BYTES:
+                            skipped.append(info.filename)
+                            continue
+                        add(f"{uploaded_file.name}/{info.filename}", archive.read(info))
+            except zipfile.BadZipFile:
+                skipped.append(uploaded_file.name)
+        else:
+            add(uploaded_file.name, uploaded_file.getvalue())
+    return images, skipped
@@ -0,0 +1,194 @@
+# yakujihou.py
+import unicodedata
+from collections import deque
+
+import streamlit as st
+
+import llm_scheduler
+import prompts
+import scoring
+
+# 薬機法チェックの対象となる業種
+YAKUJIHOU_INDUSTRIES = ["美容", "健康", "医療"]
+
+LOCAL_OK_RESULT = "OK - NG表現は検出されませんでした（ローカルチェック）"
+
+# --- ローカルのNG表現辞書（表現 → 理由） ---
+# 1つでも該当すればAIによる詳細チェックに回す。該当がなければAIを呼ばない
+NG_EXPRESSIONS = {
+    # 医薬品的な効能効果
+    "治る": "治療効果の表現", "治す": "治療効果の表現", "治療": "医療行為の示唆", "完治": "治療効果の表現",
+    "効く": "効能効果の断定", "効能": "効能効果の表現", "特効": "効能効果の断定",
+    "改善する": "効能効果の表現", "予防": "効能効果の表現", "再生": "医薬品的な効能の表現",
+    # 即効性・永続性・効果の保証
+    "即効": "効果の即時性の保証", "すぐに効果": "効果の即時性の保証", "1回で": "効果の即時性の保証",
+    "永久": "効果の永続性の保証", "一生": "効果の永続性の保証", "二度と生えない": "効果の永続性の保証",
+    "必ず": "効果の保証", "絶対": "効果の保証", "100%": "効果の保証", "確実に": "効果の保証",
+    "副作用なし": "安全性の保証", "副作用がない": "安全性の保証", "安全性が保証": "安全性の保証",
+    # 医療行為の示唆
+    "医療脱毛": "医療行為の示唆", "医療レベル": "医療行為の示唆", "医療用": "医療行為の示唆",
+    "クリニック級": "医療行為の示唆", "手術": "医療行為の示唆", "注射": "医療行為の示唆",
+    "医師推奨": "医薬関係者の推薦", "医師が認めた": "医薬関係者の推薦", "医者も": "医薬関係者の推薦",
+    # 身体の変化の断定
+    "シミが消える": "身体の変化の断定", "シワが消える": "身体の変化の断定", "ニキビが治": "治療効果の表現",
+    "若返る": "身体の変化の断定", "痩せる": "身体の変化の断定", "脂肪燃焼": "身体の変化の断定",
+    "脂肪が落ちる": "身体の変化の断定", "発毛": "医薬品的な効能の表現", "デトックス": "身体の変化の断定",
+    "細胞": "医薬品的な効能の表現", "アンチエイジング": "身体の変化の断定",
+    # 最大級表現
+    "最高": "最大級表現", "最強": "最大級表現", "日本一": "最大級表現", "no.1": "最大級表現",
+}
+
+
+def needs_yakujihou_check(industry):
+    """業種が薬機法チェックの対象かどうかを返す"""
+    return industry in YAKUJIHOU_INDUSTRIES
+
+
+def request_yakujihou_check(client, comment, uid=None, plan=None):
+    """薬機法チェックをAIに依頼し、(結果テキスト, トークン使用量) を返す（キャッシュなし）"""
+    response = llm_scheduler.get_scheduler().create_chat_completion(
+        client,
+        uid=uid,
+        plan=plan,
+        model="gpt-4o",
+        messages=prompts.YAKUJIHOU.messages(comment=comment),
+        max_tokens=500,
+        temperature=0.3,
+    )
+    if not response.choices:
+        return "薬機法チェックの結果を取得できませんでした。", scoring.usage_from_response(response)
+    return response.choices[0].message.content.strip(), scoring.usage_from_response(response)
+
+
+@st.cache_data(ttl=24 * 60 * 60, max_entries=1000, show_spinner=False)
+def _check_yakujihou_cached(_client, comment, industry, prompt_version, _uid=None, _plan=None):
+    # _client / _uid / _plan はハッシュ対象外。キャッシュキーは (comment, industry, プロンプトのバージョン)
+    result, _ = request_yakujihou_check(_client, comment, _uid, _plan)
+    return result
+
+
+def normalize_text(text):
+    """全角・半角と大文字・小文字の揺れをなくす（NFKC＋小文字化）"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _normalize_with_offsets(text):
+    # 1文字ずつ正規化し、正規化後の各文字が元テキストの何文字目かを記録する（強調表示で元の表記を残すため）
+    chars = []
+    offsets = []
+    for index, char in enumerate(text):
+        for normalized in normalize_text(char):
+            chars.append(normalized)
+            offsets.append(index)
+    return "".join(chars), offsets
+
+
+class NgExpressionMatcher:
+    """Aho-Corasick法で、複数のNG表現を1回の走査でまとめて検出する"""
+
+    def __init__(self, expressions):
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+        self._reasons = {}
+
+        for expression, reason in expressions.items():
+            word = normalize_text(expression)
+            self._reasons[word] = reason
+            state = 0
+            for char in word:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._outputs[state].append(word)
+
+        # 失敗リンクを幅優先で張る
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def find_all(self, text):
+        """正規化済みテキスト中の一致をすべて返す"""
+        matches = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for word in self._outputs[state]:
+                matches.append({
+                    "start": index - len(word) + 1,
+                    "end": index + 1,
+                    "word": word,
+                    "reason": self._reasons[word],
+                })
+        return matches
+
+
+NG_MATCHER = NgExpressionMatcher(NG_EXPRESSIONS)
+
+
+def find_ng_expressions(text):
+    """テキスト中のNG表現を検出し、一致のリストを返す（start/end は元テキストでの位置）"""
+    normalized, offsets = _normalize_with_offsets(text or "")
+    matches = NG_MATCHER.find_all(normalized)
+    for match in matches:
+        match["start"] = offsets[match["start"]]
+        match["end"] = offsets[match["end"] - 1] + 1
+    return matches
+
+
+def highlight_ng_expressions(text):
+    """NG表現を赤背景で強調したMarkdownと一致リストを返す"""
+    matches = find_ng_expressions(text)
+    if not matches:
+        return text, []
+
+    # 重なった一致はまとめて1つの範囲として強調する
+    spans = []
+    for match in sorted(matches, key=lambda m: (m["start"], -m["end"])):
+        if spans and match["start"] < spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], match["end"])
+        else:
+            spans.append([match["start"], match["end"]])
+
+    parts = []
+    position = 0
+    for start, end in spans:
+        parts.append(text[position:start])
+        parts.append(f":red-background[{text[start:end]}]")
+        position = end
+    parts.append(text[position:])
+    return "".join(parts), matches
+
+
+def format_ng_reasons(matches):
+    """一致したNG表現と理由を「表現（理由）」の一覧にする"""
+    seen = {}
+    for match in matches:
+        seen.setdefault(match["word"], match["reason"])
+    return "、".join(f"「{word}」（{reason}）" for word, reason in seen.items())
+
+
+def check_yakujihou(client, comment, industry, uid=None, plan=None):
+    """薬機法チェックを実行する。ローカル辞書でNG表現が見つからなければAIは呼ばない。
+    同じ (コメント, 業種) の結果はキャッシュから返す"""
+    matches = find_ng_expressions(comment)
+    if not matches:
+        return LOCAL_OK_RESULT
+    return _check_yakujihou_cached(client, comment, industry, prompts.YAKUJIHOU.id, uid, plan)
+
+
+def is_ok(result):
+    """チェック結果が問題なしかどうかを返す"""
+    return "OK" in result